@@ -0,0 +1,129 @@
+"""准入控制：限制同时进行的上游抓取数量，排队过长时直接返回 503"""
+import asyncio
+import logging
+import os
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import AsyncIterator, Iterator, Optional
+
+from fastapi import HTTPException
+
+from metrics import ADMISSION_INFLIGHT, ADMISSION_QUEUE, ADMISSION_SHED
+
+logger = logging.getLogger(__name__)
+
+# 同时进行的冷请求（缓存未命中）上限、排队上限和最长排队时间
+MAX_INFLIGHT = int(os.getenv("ADMISSION_MAX_INFLIGHT", 32))
+MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", 64))
+QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", 2))
+RETRY_AFTER = int(os.getenv("ADMISSION_RETRY_AFTER", 2))
+
+# 后台任务中的上游抓取（包括它启动的 singleflight 任务）等待名额而不是被拒绝
+_background: ContextVar[bool] = ContextVar("admission_background", default=False)
+
+
+class AdmissionController:
+    """Bound concurrent upstream work with a short wait queue.
+
+    Only cache misses go through here, so cache hits are never queued behind
+    cold fetches. When the queue is full, or a request waits longer than
+    ``queue_timeout``, the request is shed with 503 and ``Retry-After``.
+    Work inside ``background()`` waits for a slot as long as it takes and does
+    not count against the queue limit.
+    """
+
+    def __init__(self, max_inflight: int = MAX_INFLIGHT, max_queue: int = MAX_QUEUE,
+                 queue_timeout: float = QUEUE_TIMEOUT, retry_after: int = RETRY_AFTER):
+        self.max_inflight = max_inflight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        # 信号量在第一次使用时创建：Python 3.9 中它绑定到创建时的事件循环，
+        # 而模块导入时的循环不是 uvicorn、gunicorn worker 或 export.py 运行的循环
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.inflight = 0
+        self.waiting = 0
+        self.background_waiting = 0
+        self.admitted = 0
+        self.shed = 0
+
+    @contextmanager
+    def background(self) -> Iterator[None]:
+        """Mark the upstream work started in this block as background work."""
+        token = _background.set(True)
+        try:
+            yield
+        finally:
+            _background.reset(token)
+
+    def _shed(self, reason: str) -> HTTPException:
+        self.shed += 1
+        ADMISSION_SHED.labels(reason).inc()
+        logger.warning(f"服务繁忙，拒绝请求: {reason}（进行中 {self.inflight}，排队 {self.waiting}）")
+        return HTTPException(
+            status_code=503,
+            detail="Server is busy, please retry later",
+            headers={"Retry-After": str(self.retry_after)},
+        )
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        """当前事件循环的信号量，换了循环（例如测试或新进程）时重新创建"""
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.max_inflight)
+            self._loop = loop
+        return self._semaphore
+
+    async def _acquire(self) -> asyncio.Semaphore:
+        semaphore = self._get_semaphore()
+        if _background.get():
+            self.background_waiting += 1
+            try:
+                await semaphore.acquire()
+            finally:
+                self.background_waiting -= 1
+            return semaphore
+        if semaphore.locked():
+            if self.waiting >= self.max_queue:
+                raise self._shed("queue_full")
+            self.waiting += 1
+            ADMISSION_QUEUE.inc()
+            try:
+                await asyncio.wait_for(semaphore.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                raise self._shed("queue_timeout")
+            finally:
+                self.waiting -= 1
+                ADMISSION_QUEUE.dec()
+        else:
+            await semaphore.acquire()
+        return semaphore
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        """Hold one in-flight slot for the duration of the block."""
+        semaphore = await self._acquire()
+        self.inflight += 1
+        self.admitted += 1
+        ADMISSION_INFLIGHT.inc()
+        try:
+            yield
+        finally:
+            self.inflight -= 1
+            ADMISSION_INFLIGHT.dec()
+            semaphore.release()
+
+    def stats(self) -> dict:
+        return {
+            "inflight": self.inflight,
+            "waiting": self.waiting,
+            "background_waiting": self.background_waiting,
+            "max_inflight": self.max_inflight,
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "shed": self.shed,
+        }
+
+
+admission = AdmissionController()
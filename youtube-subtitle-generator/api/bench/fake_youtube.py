@@ -0,0 +1,245 @@
+"""YouTube 替身服务：回放录制的观看页面、timedtext 和 oEmbed 响应，可注入延迟和错误
+
+    python bench/fake_youtube.py --port 9000 --latency 0.05 --error-rate 0.01
+    python bench/fake_youtube.py record VIDEO_ID [VIDEO_ID ...]
+
+record 从 YouTube 录制到 bench/fixtures/<video_id>/。没有录制的视频 ID 按 --cues 生成合成数据，
+这样压测可以用任意多个不同的视频 ID 走冷缓存路径。API 通过 YOUTUBE_BASE_URL 指向本服务。
+"""
+import argparse
+import asyncio
+import html
+import json
+import os
+import random
+import re
+import sys
+from collections import Counter
+from typing import List, Optional
+
+import httpx
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from watchpage import CaptionTrackScanner  # noqa: E402
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+YOUTUBE = "https://www.youtube.com"
+
+_PLAYER_RESPONSE = "var ytInitialPlayerResponse = "
+
+
+def fixture_path(video_id: str, name: str) -> str:
+    return os.path.join(FIXTURES_DIR, video_id, name)
+
+
+def read_fixture(video_id: str, name: str) -> Optional[bytes]:
+    # 视频 ID 只允许字母、数字、- 和 _，避免路径穿越
+    if not re.fullmatch(r"[\w-]+", video_id):
+        return None
+    try:
+        with open(fixture_path(video_id, name), "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def timedtext_name(language: str, kind: Optional[str], fmt: Optional[str]) -> str:
+    """同一语言可能同时有手动字幕和自动字幕，文件名中带上 kind"""
+    return f"timedtext.{language}.{'asr' if kind == 'asr' else 'manual'}.{fmt if fmt in ('srv3', 'json3') else 'xml'}"
+
+
+def _html_escape(text: str) -> str:
+    return html.escape(text).replace("&#x27;", "&#39;")
+
+
+class Synthetic:
+    """为没有录制的视频生成结构和真实响应相同的数据"""
+
+    def __init__(self, cues: int, page_bytes: int):
+        self.cues = cues
+        self.page_bytes = page_bytes
+
+    def watch_page(self, video_id: str, base_url: str) -> str:
+        tracks = [
+            {
+                "baseUrl": f"{base_url}/api/timedtext?v={video_id}&lang=en",
+                "name": {"simpleText": "English"},
+                "vssId": ".en",
+                "languageCode": "en",
+                "isTranslatable": True,
+            },
+            {
+                "baseUrl": f"{base_url}/api/timedtext?v={video_id}&lang=ja&kind=asr",
+                "name": {"simpleText": "Japanese (auto-generated)"},
+                "vssId": "a.ja",
+                "languageCode": "ja",
+                "kind": "asr",
+                "isTranslatable": True,
+            },
+        ]
+        # 和真实页面一样，captions 在 videoDetails 之前
+        player = {
+            "captions": {"playerCaptionsTracklistRenderer": {"captionTracks": tracks}},
+            "videoDetails": {"videoId": video_id, "title": f"Video {video_id}"},
+        }
+        # 真实页面中字幕轨道之前有大量脚本和样式
+        filler = "<script>var ytcfg = {};</script>" * (self.page_bytes // 32)
+        # 真实页面中的 JSON 没有多余空格
+        player_json = json.dumps(player, separators=(",", ":"))
+        return f"<html><head>{filler}</head><body><script>{_PLAYER_RESPONSE}{player_json};</script></body></html>"
+
+    def cue_texts(self, video_id: str, language: str) -> List[str]:
+        rng = random.Random(f"{video_id}:{language}")
+        words = ["we", "don't", "know", "what", "the", "model", "says", "about", "this", "video", "&", "<it>"]
+        return [
+            " ".join(rng.choice(words) for _ in range(rng.randint(3, 9))) + ("." if index % 4 == 3 else "")
+            for index in range(self.cues)
+        ]
+
+    def timedtext(self, video_id: str, language: str, fmt: Optional[str]) -> str:
+        texts = self.cue_texts(video_id, language)
+        if fmt == "json3":
+            events = [
+                {"tStartMs": index * 2500, "dDurationMs": 2500, "segs": [{"utf8": text}]}
+                for index, text in enumerate(texts)
+            ]
+            return json.dumps({"events": events})
+        if fmt == "srv3":
+            body = "".join(
+                f'<p t="{index * 2500}" d="2500">' + "".join(
+                    f"<s>{_html_escape(word if position == 0 else ' ' + word)}</s>"
+                    for position, word in enumerate(text.split(" "))
+                ) + "</p>"
+                for index, text in enumerate(texts)
+            )
+            return f'<?xml version="1.0" encoding="utf-8" ?><timedtext format="3"><body>{body}</body></timedtext>'
+        # YouTube 的 XML 中撇号等字符是二次转义的（&amp;#39;）
+        body = "".join(
+            f'<text start="{index * 2.5}" dur="2.5">{html.escape(_html_escape(text), quote=False)}</text>'
+            for index, text in enumerate(texts)
+        )
+        return f'<?xml version="1.0" encoding="utf-8" ?><transcript>{body}</transcript>'
+
+    def oembed(self, video_id: str) -> dict:
+        return {
+            "title": f"Video {video_id}",
+            "author_name": "Bench",
+            "author_url": f"{YOUTUBE}/@bench",
+            "type": "video",
+            "height": 113,
+            "width": 200,
+            "version": "1.0",
+            "provider_name": "YouTube",
+            "provider_url": f"{YOUTUBE}/",
+            "thumbnail_url": f"https://i.ytimg.com/vi/{video_id}/hqdefault.jpg",
+        }
+
+
+def create_app(latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0, error_status: int = 503,
+               cues: int = 400, page_bytes: int = 300_000) -> FastAPI:
+    app = FastAPI(title="Fake YouTube")
+    synthetic = Synthetic(cues, page_bytes)
+    requests = Counter()
+
+    @app.middleware("http")
+    async def inject(request: Request, call_next):
+        requests[request.url.path] += 1
+        if latency or jitter:
+            await asyncio.sleep(latency + random.uniform(0, jitter))
+        if error_rate and random.random() < error_rate:
+            requests["errors"] += 1
+            return Response(status_code=error_status, headers={"Retry-After": "1"})
+        return await call_next(request)
+
+    def base_url(request: Request) -> str:
+        return str(request.base_url).rstrip("/")
+
+    @app.get("/watch")
+    async def watch(request: Request, v: str):
+        page = read_fixture(v, "watch.html")
+        if page is None:
+            return Response(synthetic.watch_page(v, base_url(request)), media_type="text/html")
+        # 录制的字幕地址指向 YouTube，改为指向本服务
+        page = page.replace(f"{YOUTUBE}/api/timedtext".encode(), f"{base_url(request)}/api/timedtext".encode())
+        return Response(page, media_type="text/html")
+
+    @app.get("/api/timedtext")
+    async def timedtext(v: str, lang: str = "en", kind: Optional[str] = None, fmt: Optional[str] = None):
+        body = read_fixture(v, timedtext_name(lang, kind, fmt))
+        if body is None and read_fixture(v, "watch.html") is not None:
+            # 录制过的视频没有这个语言
+            return Response(b"", media_type="text/xml")
+        if body is None:
+            body = synthetic.timedtext(v, lang, fmt).encode()
+        return Response(body, media_type="application/json" if fmt == "json3" else "text/xml")
+
+    @app.get("/oembed")
+    async def oembed(url: str):
+        video_id = httpx.URL(url).params.get("v", "")
+        body = read_fixture(video_id, "oembed.json")
+        if body is None:
+            return JSONResponse(synthetic.oembed(video_id))
+        return Response(body, media_type="application/json")
+
+    @app.get("/_stats")
+    async def stats():
+        """压测脚本读取上游请求次数"""
+        return dict(requests)
+
+    return app
+
+
+def record(video_ids: List[str]) -> None:
+    """从 YouTube 录制观看页面、每个字幕轨道（srv1、srv3 和 json3）以及 oEmbed 响应"""
+    headers = {"User-Agent": "Mozilla/5.0", "Accept-Language": "en-US,en;q=0.9"}
+    with httpx.Client(headers=headers, timeout=30, follow_redirects=True) as client:
+        for video_id in video_ids:
+            os.makedirs(os.path.join(FIXTURES_DIR, video_id), exist_ok=True)
+            page = client.get(f"{YOUTUBE}/watch", params={"v": video_id}).text
+            with open(fixture_path(video_id, "watch.html"), "w", encoding="utf-8") as f:
+                f.write(page)
+            oembed = client.get(f"{YOUTUBE}/oembed", params={"format": "json", "url": f"{YOUTUBE}/watch?v={video_id}"})
+            with open(fixture_path(video_id, "oembed.json"), "wb") as f:
+                f.write(oembed.content)
+
+            # 和 API 使用同一个扫描器，轨道中嵌套的数组不会提前结束匹配
+            scanner = CaptionTrackScanner()
+            scanner.feed(page)
+            tracks = scanner.tracks() or []
+            for track in tracks:
+                language, kind = track["languageCode"], track.get("kind")
+                for fmt in (None, "srv3", "json3"):
+                    url = track["baseUrl"] + (f"&fmt={fmt}" if fmt else "")
+                    with open(fixture_path(video_id, timedtext_name(language, kind, fmt)), "wb") as f:
+                        f.write(client.get(url).content)
+            print(f"{video_id}: {len(tracks)} 个字幕轨道", file=sys.stderr)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] == "record":
+        record(argv[1:])
+        return 0
+
+    parser = argparse.ArgumentParser(description="Local stand-in for YouTube with latency and error injection")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--latency", type=float, default=0.0, help="added delay per response in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="extra random delay up to this many seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests that fail")
+    parser.add_argument("--error-status", type=int, default=503, help="status code of injected failures")
+    parser.add_argument("--cues", type=int, default=400, help="cues per synthetic caption track")
+    parser.add_argument("--page-bytes", type=int, default=300_000, help="size of synthetic watch pages")
+    args = parser.parse_args(argv)
+
+    app = create_app(args.latency, args.jitter, args.error_rate, args.error_status, args.cues, args.page_bytes)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,104 @@
+"""字幕解析的微基准：比较 timedtext.parse_timedtext 和原来的正则加 replace 的解析方式
+
+    python bench/parse_bench.py
+    python bench/parse_bench.py --hours 1 3 10 --repeat 5
+
+按每 2.5 秒一条字幕生成多小时的轨道，分别测 srv1、srv3、json3 的耗时（取多次中最快的一次）
+以及单次解析的内存分配峰值（tracemalloc）。
+"""
+import argparse
+import gc
+import json
+import os
+import re
+import sys
+import time
+import tracemalloc
+from typing import Callable, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_youtube import Synthetic  # noqa: E402
+from timedtext import parse_timedtext  # noqa: E402
+from transcript import Transcript  # noqa: E402
+
+_LEGACY_PATTERN = re.compile(r'<text start="([\d\.]+)"(?: dur="([\d\.]+)")?[^>]*>(.*?)</text>')
+
+
+def legacy_parse(caption_xml: str) -> Transcript:
+    """原来的实现：先试正则，失败后再当作 JSON 解析，每条字幕四次 replace"""
+    cues = []
+    matches = _LEGACY_PATTERN.findall(caption_xml)
+    if not matches:
+        try:
+            json_data = json.loads(caption_xml)
+            if "events" in json_data:
+                for event in json_data["events"]:
+                    if "segs" in event and "tStartMs" in event:
+                        cues.append((
+                            event["tStartMs"] / 1000,
+                            event.get("dDurationMs", 0) / 1000,
+                            "".join([seg.get("utf8", "") for seg in event["segs"]]),
+                        ))
+        except Exception:
+            pass
+    else:
+        for start, dur, text in matches:
+            cues.append((
+                float(start),
+                float(dur) if dur else 0.0,
+                text.replace("&amp;", "&").replace("&lt;", "<").replace("&gt;", ">").replace("&quot;", '"'),
+            ))
+    return Transcript.from_cues(cues)
+
+
+def best_time(parse: Callable[[str], Transcript], body: str, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        started = time.perf_counter()
+        parse(body)
+        times.append(time.perf_counter() - started)
+    return min(times)
+
+
+def peak_allocation(parse: Callable[[str], Transcript], body: str) -> int:
+    """单次解析过程中分配内存的峰值（字节），不含输入"""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        parse(body)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Micro-benchmark the timedtext parser")
+    parser.add_argument("--hours", type=float, nargs="+", default=[1, 3, 10], help="track lengths in hours")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per measurement, the fastest is reported")
+    args = parser.parse_args(argv)
+
+    print(f"{'track':<8} {'format':<6} {'parser':<8} {'cues':>6} {'time ms':>9} {'peak KB':>9}")
+    for hours in args.hours:
+        cues = int(hours * 3600 / 2.5)
+        synthetic = Synthetic(cues, 0)
+        for format in ("srv1", "srv3", "json3"):
+            body = synthetic.timedtext("benchmark01", "en", None if format == "srv1" else format)
+            parsers = [("new", parse_timedtext)]
+            # 原来的实现不支持 srv3
+            if format != "srv3":
+                parsers.append(("legacy", legacy_parse))
+            for name, parse in parsers:
+                count = len(parse(body))
+                elapsed = best_time(parse, body, args.repeat)
+                peak = peak_allocation(parse, body)
+                print(
+                    f"{f'{hours:g}h':<8} {format:<6} {name:<8} {count:>6} {elapsed * 1000:>9.2f} {peak / 1024:>9.0f}"
+                )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
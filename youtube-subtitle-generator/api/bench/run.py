@@ -0,0 +1,261 @@
+"""压测脚本：启动 YouTube 替身服务和 API，按指定并发请求各接口，输出吞吐量、延迟分位数和内存
+
+    python bench/run.py --requests 500 --concurrency 32
+    python bench/run.py --latency 0.05 --error-rate 0.01 --label slow-upstream
+
+每个接口测两种场景：cold 每个请求用新的视频 ID（抓取和解析路径），warm 反复请求已缓存的视频。
+结果保存到 bench/results/，并和上一次的结果对比，方便发现版本之间的性能退化。
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import List, Optional
+
+import httpx
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+API_DIR = os.path.dirname(BENCH_DIR)
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+
+ENDPOINTS = ("video-data", "video-captions", "video-timestamps")
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def rss_bytes(pid: int) -> Optional[int]:
+    """进程当前的常驻内存，只支持 Linux"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return None
+
+
+def percentile(values: List[float], q: float) -> float:
+    """最近秩法，values 需要已排序"""
+    if not values:
+        return 0.0
+    index = max(0, min(len(values) - 1, int(round(q * len(values) + 0.5)) - 1))
+    return values[index]
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=API_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+async def wait_ready(url: str, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while True:
+            try:
+                await client.get(url)
+                return
+            except httpx.TransportError:
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"{url} did not start within {timeout}s")
+                await asyncio.sleep(0.2)
+
+
+async def run_scenario(client: httpx.AsyncClient, endpoint: str, video_ids: List[str], requests: int,
+                       concurrency: int, pid: Optional[int]) -> dict:
+    """按并发数发送 requests 个请求，video_ids 循环使用"""
+    latencies: List[float] = []
+    statuses = {}
+    next_index = 0
+
+    async def worker():
+        nonlocal next_index
+        while next_index < requests:
+            index = next_index
+            next_index += 1
+            payload = {"url": f"https://www.youtube.com/watch?v={video_ids[index % len(video_ids)]}"}
+            started = time.perf_counter()
+            try:
+                response = await client.post(f"/{endpoint}", json=payload)
+                # 读完响应体再计时
+                await response.aread()
+                status = str(response.status_code)
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            latencies.append(time.perf_counter() - started)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    rss_before = rss_bytes(pid) if pid else None
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - started
+    rss_after = rss_bytes(pid) if pid else None
+
+    latencies.sort()
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "elapsed": round(elapsed, 3),
+        "rps": round(requests / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "max_ms": round(latencies[-1] * 1000, 2),
+        "statuses": statuses,
+        "rss_mb": round(rss_after / 2**20, 1) if rss_after else None,
+        # 冷请求主要是缓存和索引的增长
+        "rss_kb_per_request": round((rss_after - rss_before) / 1024 / requests, 2) if rss_after and rss_before else None,
+    }
+
+
+async def benchmark(args: argparse.Namespace, api_url: str, fake_url: str, pid: Optional[int]) -> dict:
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    results = {}
+    async with httpx.AsyncClient(base_url=api_url, limits=limits, timeout=60) as client:
+        for position, endpoint in enumerate(args.endpoints):
+            # 11 位视频 ID；每个接口用不同的前缀，保证 cold 场景不会命中前一个接口写入的缓存
+            cold_ids = [f"c{position}{index:09d}" for index in range(args.requests)]
+            warm_ids = [f"w{position}{index:09d}" for index in range(args.videos)]
+            # 预热：warm 场景的视频先各请求一次
+            await run_scenario(client, endpoint, warm_ids, len(warm_ids), args.concurrency, None)
+
+            for scenario, video_ids in (("cold", cold_ids), ("warm", warm_ids)):
+                result = await run_scenario(client, endpoint, video_ids, args.requests, args.concurrency, pid)
+                results[f"{endpoint}:{scenario}"] = result
+                print_row(f"{endpoint}:{scenario}", result)
+
+        upstream = (await client.get(f"{fake_url}/_stats")).json()
+    return {"scenarios": results, "upstream_requests": upstream}
+
+
+def print_row(name: str, result: dict) -> None:
+    errors = sum(count for status, count in result["statuses"].items() if status != "200")
+    memory = f"{result['rss_kb_per_request']:>7} KB/req" if result["rss_kb_per_request"] is not None else ""
+    print(
+        f"{name:<24} {result['rps']:>8} req/s  p50 {result['p50_ms']:>8} ms  p95 {result['p95_ms']:>8} ms  "
+        f"p99 {result['p99_ms']:>8} ms  errors {errors:>4}  {memory}",
+        flush=True,
+    )
+
+
+def latest_result(label: str, exclude: Optional[str]) -> Optional[str]:
+    """同一 label 最近一次保存的结果"""
+    if not os.path.isdir(RESULTS_DIR):
+        return None
+    files = sorted(
+        name for name in os.listdir(RESULTS_DIR)
+        if name.endswith(f"-{label}.json") and os.path.join(RESULTS_DIR, name) != exclude
+    )
+    return os.path.join(RESULTS_DIR, files[-1]) if files else None
+
+
+def compare(current: dict, baseline_path: str) -> None:
+    """和基线比较吞吐量和 p95，变化超过 10% 的标出来"""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    print(f"\n对比 {os.path.basename(baseline_path)} ({baseline.get('revision')}):")
+    for name, result in current["scenarios"].items():
+        old = baseline.get("scenarios", {}).get(name)
+        if not old:
+            continue
+        rps_change = (result["rps"] - old["rps"]) / old["rps"] if old["rps"] else 0.0
+        p95_change = (result["p95_ms"] - old["p95_ms"]) / old["p95_ms"] if old["p95_ms"] else 0.0
+        flag = "  <-- regression" if rps_change < -0.1 or p95_change > 0.1 else ""
+        print(f"{name:<24} rps {rps_change:+7.1%}  p95 {p95_change:+7.1%}{flag}")
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark the API against a local YouTube stand-in")
+    parser.add_argument("--requests", type=int, default=500, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--videos", type=int, default=50, help="distinct videos in warm scenarios")
+    parser.add_argument("--endpoints", type=lambda value: value.split(","), default=list(ENDPOINTS),
+                        help=f"comma-separated, default {','.join(ENDPOINTS)}")
+    parser.add_argument("--latency", type=float, default=0.0, help="stand-in delay per response in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--cues", type=int, default=400, help="cues per synthetic caption track")
+    parser.add_argument("--label", default="default", help="stored with the results")
+    parser.add_argument("--compare", help="result file to compare with, default the latest one")
+    parser.add_argument("--no-save", action="store_true", help="do not store the results")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    fake_port, api_port = free_port(), free_port()
+    fake_url, api_url = f"http://127.0.0.1:{fake_port}", f"http://127.0.0.1:{api_port}"
+    workdir = tempfile.mkdtemp(prefix="youtube-api-bench-")
+
+    env = dict(
+        os.environ,
+        YOUTUBE_BASE_URL=fake_url,
+        FALLBACK_ENABLED="false",
+        # 替身服务不需要限流，熔断保持默认以便观察错误注入的效果
+        HTTP_HOST_RATE="1000000",
+        HTTP_HOST_BURST="1000000",
+        CACHE_DB_PATH=os.path.join(workdir, "cache.db"),
+        JOBS_DB_PATH=os.path.join(workdir, "jobs.db"),
+        SEARCH_DB_PATH=os.path.join(workdir, "search.db"),
+        LOG_LEVEL=os.getenv("LOG_LEVEL", "WARNING"),
+    )
+    fake = subprocess.Popen([
+        sys.executable, os.path.join(BENCH_DIR, "fake_youtube.py"), "--port", str(fake_port),
+        "--latency", str(args.latency), "--jitter", str(args.jitter), "--error-rate", str(args.error_rate),
+        "--cues", str(args.cues),
+    ])
+    api = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(api_port), "--log-level", "warning"],
+        cwd=API_DIR, env=env,
+    )
+    try:
+        asyncio.run(wait_ready(f"{fake_url}/_stats"))
+        asyncio.run(wait_ready(f"{api_url}/cache-stats"))
+        result = asyncio.run(benchmark(args, api_url, fake_url, api.pid))
+    finally:
+        api.terminate()
+        fake.terminate()
+        api.wait()
+        fake.wait()
+
+    result.update({
+        "label": args.label,
+        "revision": git_revision(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "settings": {key: getattr(args, key) for key in ("requests", "concurrency", "videos", "latency",
+                                                         "jitter", "error_rate", "cues")},
+    })
+    path = None
+    if not args.no_save:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        path = os.path.join(RESULTS_DIR, f"{datetime.now():%Y%m%d-%H%M%S}-{result['revision']}-{args.label}.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+        print(f"\n结果已保存到 {path}")
+
+    baseline = args.compare or latest_result(args.label, exclude=path)
+    if baseline:
+        compare(result, baseline)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,365 @@
+"""两级缓存：进程内 LRU（按字节计量）+ 持久化 SQLite，用于字幕和视频元数据"""
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from fetcher import run_blocking
+
+logger = logging.getLogger(__name__)
+
+CACHE_DB_PATH = os.getenv("CACHE_DB_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache.db"))
+CACHE_MEMORY_BYTES = int(os.getenv("CACHE_MEMORY_BYTES", 64 * 1024 * 1024))
+TRANSCRIPT_CACHE_TTL = int(os.getenv("TRANSCRIPT_CACHE_TTL", 7 * 24 * 3600))
+METADATA_CACHE_TTL = int(os.getenv("METADATA_CACHE_TTL", 24 * 3600))
+# 元数据过期后在这段时间内仍然先返回旧数据，同时在后台刷新
+METADATA_STALE_TTL = int(os.getenv("METADATA_STALE_TTL", 7 * 24 * 3600))
+# 字幕轨道地址带有过期签名
+TRACK_INDEX_TTL = int(os.getenv("TRACK_INDEX_TTL", 3600))
+# "Subtitles are disabled" 之类的失败结果缓存时间短一些
+NEGATIVE_CACHE_TTL = int(os.getenv("NEGATIVE_CACHE_TTL", 600))
+# 磁盘层在事件循环中同步读写，多个 worker 进程争用写锁时最多等这么久，超时按未命中处理
+CACHE_DB_BUSY_TIMEOUT = float(os.getenv("CACHE_DB_BUSY_TIMEOUT", 0.05))
+# 定期删除过期条目；过期后至少保留 METADATA_STALE_TTL，serve_stale 和 get_many(max_stale=...) 还要读取它们
+CACHE_PURGE_INTERVAL = float(os.getenv("CACHE_PURGE_INTERVAL", 3600))
+CACHE_PURGE_GRACE = max(int(os.getenv("CACHE_PURGE_GRACE", METADATA_STALE_TTL)), METADATA_STALE_TTL)
+CACHE_PURGE_BATCH = 1000
+
+
+def _to_json(value: Any) -> Any:
+    """让带 to_cache() 的对象（例如 Transcript）可以写入 SQLite"""
+    if hasattr(value, "to_cache"):
+        return value.to_cache()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class MemoryLRU:
+    """按序列化后字节数限制容量的 LRU"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.evictions = 0
+        self._data: "OrderedDict[str, Tuple[float, Any, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Tuple[float, Any]]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            self._data.move_to_end(key)
+            return item[0], item[1]
+
+    def set(self, key: str, value: Any, expires_at: float, size: int) -> None:
+        # 单个条目超过总容量时不放进内存，只存 SQLite
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.current_bytes -= old[2]
+            self._data[key] = (expires_at, value, size)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes and self._data:
+                _, (_, _, evicted_size) = self._data.popitem(last=False)
+                self.current_bytes -= evicted_size
+                self.evictions += 1
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.current_bytes -= old[2]
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+def connect_sqlite(path: str, schema: Iterable[str] = (), timeout: float = 5,
+                   row_factory: Optional[Callable] = None) -> sqlite3.Connection:
+    """打开可以跨线程使用的连接（由调用方加锁），开启 WAL 并执行建表语句"""
+    conn = sqlite3.connect(path, check_same_thread=False, timeout=timeout)
+    conn.row_factory = row_factory
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    for statement in schema:
+        conn.execute(statement)
+    conn.commit()
+    return conn
+
+
+class LazySQLite:
+    """Base for the SQLite stores: one WAL connection per process, used under ``_lock``.
+
+    The connection is opened on first use, so nothing is opened in the
+    gunicorn master before it forks the workers.
+    """
+
+    def __init__(self, path: str, schema: Iterable[str] = (), timeout: float = 5,
+                 row_factory: Optional[Callable] = None):
+        self.path = path
+        self.timeout = timeout
+        self._schema = tuple(schema)
+        self._row_factory = row_factory
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = connect_sqlite(self.path, self._schema, self.timeout, self._row_factory)
+        return self._conn
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+class SQLiteStore(LazySQLite):
+    """持久化存储，进程重启后依然可用"""
+
+    def __init__(self, path: str, timeout: float = CACHE_DB_BUSY_TIMEOUT):
+        super().__init__(path, [
+            "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL NOT NULL)",
+            "CREATE INDEX IF NOT EXISTS cache_expires_at ON cache (expires_at)",
+        ], timeout=timeout)
+
+    def get(self, key: str) -> Optional[Tuple[float, bytes]]:
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT expires_at, value FROM cache WHERE key = ?", (key,)
+            ).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def get_many(self, keys: List[str]) -> Dict[str, Tuple[float, bytes]]:
+        """一次查询多个 key，分批执行以免超过 SQLite 的参数个数限制"""
+        rows = {}
+        with self._lock:
+            conn = self._connect()
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                for key, expires_at, value in conn.execute(
+                    f"SELECT key, expires_at, value FROM cache WHERE key IN ({placeholders})", chunk
+                ):
+                    rows[key] = (expires_at, value)
+        return rows
+
+    def set(self, key: str, value: bytes, expires_at: float) -> None:
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, expires_at),
+            )
+            conn.commit()
+
+    def purge_expired(self, before: float) -> int:
+        """删除 before 之前过期的条目，返回删除的数量
+
+        在线程池中执行，使用单独的连接和较长的锁等待，不占用请求路径上的锁；分批删除，每批提交一次，写锁不会长时间被占用。
+        """
+        deleted = 0
+        # 带上建表语句：全新的数据库文件中表可能还没有被请求路径上的连接创建
+        conn = connect_sqlite(self.path, self._schema, timeout=5)
+        try:
+            while True:
+                cursor = conn.execute(
+                    "DELETE FROM cache WHERE rowid IN (SELECT rowid FROM cache WHERE expires_at < ? LIMIT ?)",
+                    (before, CACHE_PURGE_BATCH),
+                )
+                conn.commit()
+                deleted += cursor.rowcount
+                if cursor.rowcount < CACHE_PURGE_BATCH:
+                    return deleted
+        finally:
+            conn.close()
+
+
+class TieredCache:
+    """Memory LRU in front of a SQLite store, with TTLs and hit/miss counters.
+
+    Values must be JSON-serializable or contain objects with ``to_cache()``.
+    The memory tier keeps the original objects; values loaded from SQLite are
+    passed through the ``decode`` callback given to ``get``. Callers must not
+    mutate returned values, they are shared with the memory tier.
+    """
+
+    def __init__(self, path: str = CACHE_DB_PATH, max_memory_bytes: int = CACHE_MEMORY_BYTES):
+        self.memory = MemoryLRU(max_memory_bytes)
+        self.store = SQLiteStore(path)
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+        self.stale_hits = 0
+        self.writes = 0
+        self.purged = 0
+        self._purger: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        """在当前事件循环中启动定期清理过期条目的任务"""
+        if self._purger is None:
+            self._purger = asyncio.ensure_future(self._purge_loop())
+
+    async def stop(self) -> None:
+        if self._purger is not None:
+            self._purger.cancel()
+            try:
+                await self._purger
+            except asyncio.CancelledError:
+                pass
+            self._purger = None
+
+    async def _purge_loop(self) -> None:
+        while True:
+            try:
+                deleted = await run_blocking(self.store.purge_expired, time.time() - CACHE_PURGE_GRACE)
+                self.purged += deleted
+                if deleted:
+                    logger.info(f"从 SQLite 缓存中删除 {deleted} 个过期条目")
+            except Exception as e:
+                logger.warning(f"清理过期缓存失败: {str(e)}")
+            await asyncio.sleep(CACHE_PURGE_INTERVAL)
+
+    def get(self, key: str, decode: Optional[Callable[[Any], Any]] = None) -> Optional[Any]:
+        """返回未过期的缓存值，没有时返回 None"""
+        now = time.time()
+        item = self.memory.get(key)
+        if item is not None:
+            expires_at, value = item
+            if expires_at > now:
+                self.memory_hits += 1
+                self._count_negative(value)
+                return value
+            self.memory.delete(key)
+
+        try:
+            row = self.store.get(key)
+        except sqlite3.Error as e:
+            logger.warning(f"读取 SQLite 缓存失败: {str(e)}")
+            row = None
+        if row is not None:
+            expires_at, raw = row
+            if expires_at > now:
+                value = json.loads(raw)
+                if decode is not None:
+                    value = decode(value)
+                # 回填内存层
+                self.memory.set(key, value, expires_at, len(raw))
+                self.disk_hits += 1
+                self._count_negative(value)
+                return value
+
+        self.misses += 1
+        return None
+
+    def get_stale(self, key: str, decode: Optional[Callable[[Any], Any]] = None) -> Optional[Any]:
+        """忽略过期时间读取缓存，上游不可用时用来返回旧数据；过期条目在 purge_expired 之前都还在 SQLite 中"""
+        item = self.memory.get(key)
+        if item is not None:
+            return item[1]
+        try:
+            row = self.store.get(key)
+        except sqlite3.Error as e:
+            logger.warning(f"读取 SQLite 缓存失败: {str(e)}")
+            return None
+        if row is None:
+            return None
+        value = json.loads(row[1])
+        return decode(value) if decode is not None else value
+
+    def get_many(self, keys: Iterable[str], decode: Optional[Callable[[Any], Any]] = None,
+                 max_stale: float = 0) -> Dict[str, Tuple[Any, bool]]:
+        """Look up many keys at once, returning ``{key: (value, fresh)}``.
+
+        Keys missing from memory are read from SQLite in one query. Entries
+        that expired less than ``max_stale`` seconds ago are returned with
+        ``fresh`` False so the caller can serve them while refreshing; older
+        ones count as misses.
+        """
+        now = time.time()
+        found: Dict[str, Tuple[Any, bool]] = {}
+        remaining = []
+        for key in dict.fromkeys(keys):
+            item = self.memory.get(key)
+            if item is not None and item[0] + max_stale > now:
+                found[key] = (item[1], item[0] > now)
+            else:
+                remaining.append(key)
+        self.memory_hits += len(found)
+
+        rows = {}
+        if remaining:
+            try:
+                rows = self.store.get_many(remaining)
+            except sqlite3.Error as e:
+                logger.warning(f"读取 SQLite 缓存失败: {str(e)}")
+        for key in remaining:
+            row = rows.get(key)
+            if row is None or row[0] + max_stale <= now:
+                self.misses += 1
+                continue
+            expires_at, raw = row
+            value = json.loads(raw)
+            if decode is not None:
+                value = decode(value)
+            # 回填内存层，保留原来的过期时间
+            self.memory.set(key, value, expires_at, len(raw))
+            self.disk_hits += 1
+            found[key] = (value, expires_at > now)
+
+        for value, fresh in found.values():
+            if not fresh:
+                self.stale_hits += 1
+            self._count_negative(value)
+        return found
+
+    def set(self, key: str, value: Any, ttl: float) -> None:
+        raw = json.dumps(value, ensure_ascii=False, separators=(",", ":"), default=_to_json).encode("utf-8")
+        expires_at = time.time() + ttl
+        self.memory.set(key, value, expires_at, len(raw))
+        try:
+            self.store.set(key, raw, expires_at)
+        except sqlite3.Error as e:
+            logger.warning(f"写入 SQLite 缓存失败: {str(e)}")
+        self.writes += 1
+
+    def set_negative(self, key: str, status_code: int, detail: str, ttl: float = NEGATIVE_CACHE_TTL) -> None:
+        """缓存失败结果，命中时由调用方重新抛出相同的错误"""
+        self.set(key, {"error": {"status_code": status_code, "detail": detail}}, ttl)
+
+    def close(self) -> None:
+        self.store.close()
+
+    def _count_negative(self, value: Any) -> None:
+        if isinstance(value, dict) and "error" in value:
+            self.negative_hits += 1
+
+    def stats(self) -> dict:
+        hits = self.memory_hits + self.disk_hits
+        total = hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "negative_hits": self.negative_hits,
+            "stale_hits": self.stale_hits,
+            "hit_rate": hits / total if total else 0.0,
+            "writes": self.writes,
+            "purged": self.purged,
+            "memory_entries": len(self.memory),
+            "memory_bytes": self.memory.current_bytes,
+            "memory_max_bytes": self.memory.max_bytes,
+            "memory_evictions": self.memory.evictions,
+        }
+
+
+cache = TieredCache()
@@ -0,0 +1,133 @@
+"""条件请求和响应压缩：ETag 由字幕内容计算，按 Accept-Encoding 选择 br 或 gzip
+
+压缩后的响应体按 ETag 缓存在内存层中，热门视频不需要每次重新渲染和压缩。
+"""
+import gzip
+import os
+import time
+from typing import Callable, Optional, Tuple
+
+from fastapi import Request
+from fastapi.responses import Response
+
+from cache import cache, TRANSCRIPT_CACHE_TTL
+from fetcher import run_blocking
+
+try:
+    import brotli
+except ImportError:
+    # 没有安装 brotli 时只使用 gzip
+    brotli = None
+
+# 小于这个大小的响应不压缩
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", 1024))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", 6))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", 5))
+
+# 同样可接受时优先使用靠前的编码
+ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def negotiate(accept_encoding: Optional[str]) -> Optional[str]:
+    """按 Accept-Encoding 中的 q 值选择编码，都不接受时返回 None（不压缩）"""
+    if not accept_encoding:
+        return None
+    accepted = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name.lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding.strip().lower()] = q
+
+    best, best_q = None, 0.0
+    for coding in ENCODINGS:
+        q = accepted.get(coding, accepted.get("*", 0.0))
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    # mtime 固定为 0，相同内容的压缩结果相同
+    return gzip.compress(body, GZIP_LEVEL, mtime=0)
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match 使用弱比较，忽略 W/ 前缀"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == opaque for tag in if_none_match.split(","))
+
+
+class EncodedResponses:
+    """Serve rendered bodies with an ETag, a 304 for a matching ``If-None-Match``
+    and compression negotiated from ``Accept-Encoding``.
+
+    Compressed bodies are stored in the cache's memory tier under the ETag,
+    next to the transcripts, so a hot video is rendered and compressed once.
+    The ETag is derived from the content, so a changed transcript never
+    reuses an old body. Conditional requests are only honored for GET.
+    """
+
+    def __init__(self):
+        self.not_modified = 0
+        self.hits = 0
+        self.misses = 0
+        self.uncompressed = 0
+
+    @staticmethod
+    def _key(etag: str, encoding: str) -> str:
+        return f"body:{encoding}:{etag}"
+
+    async def respond(self, request: Request, etag: str, render: Callable[[], Tuple[bytes, str]]) -> Response:
+        """render 返回 (未压缩的响应体, media type)，只在需要时调用"""
+        headers = {"ETag": etag, "Vary": "Accept-Encoding", "Cache-Control": "no-cache"}
+        if request.method == "GET" and etag_matches(request.headers.get("if-none-match"), etag):
+            self.not_modified += 1
+            return Response(status_code=304, headers=headers)
+
+        encoding = negotiate(request.headers.get("accept-encoding"))
+        if encoding is not None:
+            item = cache.memory.get(self._key(etag, encoding))
+            if item is not None:
+                self.hits += 1
+                body, media_type = item[1]
+                headers["Content-Encoding"] = encoding
+                return Response(content=body, media_type=media_type, headers=headers)
+
+        body, media_type = render()
+        if encoding is None or len(body) < COMPRESS_MIN_BYTES:
+            self.uncompressed += 1
+            return Response(content=body, media_type=media_type, headers=headers)
+
+        self.misses += 1
+        # 大字幕压缩需要几毫秒，放到线程池中执行
+        encoded = await run_blocking(compress, body, encoding)
+        cache.memory.set(
+            self._key(etag, encoding), (encoded, media_type), time.time() + TRANSCRIPT_CACHE_TTL, len(encoded)
+        )
+        headers["Content-Encoding"] = encoding
+        return Response(content=encoded, media_type=media_type, headers=headers)
+
+    def stats(self) -> dict:
+        return {
+            "encodings": list(ENCODINGS),
+            "not_modified": self.not_modified,
+            "hits": self.hits,
+            "misses": self.misses,
+            "uncompressed": self.uncompressed,
+        }
+
+
+encoded_responses = EncodedResponses()
@@ -0,0 +1,291 @@
+"""离线批量导出字幕：多进程抓取，流式写入 JSONL 或 Parquet，支持断点续传
+
+    python export.py videos.txt -o transcripts.jsonl --processes 4 --concurrency 8
+
+输入文件每行一个视频 URL 或 ID，# 开头的行会被忽略。结果确实落盘之后才把对应的视频 ID 追加到
+<output>.checkpoint（JSONL 每写完一批，Parquet 每关闭一个分片文件），中断后用同样的命令重新运行会跳过
+已导出的视频。失败的视频写入 <output>.errors.jsonl，不记入 checkpoint，下次运行时会重试。
+"""
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Iterable, Iterator, List, Optional, Set
+
+from transcript import FORMATS
+
+logger = logging.getLogger("export")
+
+_VIDEO_ID = re.compile(r"^[\w-]{11}$")
+
+# 每个子进程中复用的事件循环，保持连接池和缓存在多个批次之间有效
+_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def read_video_ids(path: str) -> Iterator[str]:
+    """读取输入文件中的视频 ID，去掉重复和无法识别的行"""
+    from main import YouTubeTools
+
+    seen = set()
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            video_id = line if _VIDEO_ID.match(line) else YouTubeTools.get_youtube_video_id(line)
+            if not video_id:
+                logger.warning(f"无法识别的输入: {line}")
+                continue
+            if video_id not in seen:
+                seen.add(video_id)
+                yield video_id
+
+
+def read_checkpoint(path: str) -> Set[str]:
+    if not os.path.exists(path):
+        return set()
+    with open(path, encoding="utf-8") as f:
+        return {line.strip() for line in f if line.strip()}
+
+
+def chunked(items: Iterable[str], size: int) -> Iterator[List[str]]:
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _init_worker(log_level: str) -> None:
+    global _loop
+    # 先导入 main（其中会配置日志），再调整日志级别
+    import main  # noqa: F401
+    logging.getLogger().setLevel(log_level)
+    _loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(_loop)
+
+
+def fetch_chunk(video_ids: List[str], languages: Optional[List[str]], format: str, concurrency: int) -> List[dict]:
+    """在子进程中抓取一批视频，同时进行的请求数不超过 concurrency"""
+    return _loop.run_until_complete(_fetch_chunk(video_ids, languages, format, concurrency))
+
+
+async def _fetch_chunk(video_ids: List[str], languages: Optional[List[str]], format: str,
+                       concurrency: int) -> List[dict]:
+    from fastapi import HTTPException
+    from main import YouTubeTools
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch(video_id: str) -> dict:
+        record = {"video_id": video_id}
+        async with semaphore:
+            try:
+                transcript = await YouTubeTools.get_transcript(
+                    f"https://www.youtube.com/watch?v={video_id}", languages
+                )
+                record["language"] = transcript.language
+                record["captions"] = transcript.render(format)
+            except HTTPException as e:
+                record["error"] = {"status_code": e.status_code, "detail": e.detail}
+            except Exception as e:
+                record["error"] = {"status_code": 500, "detail": str(e)}
+        return record
+
+    return await asyncio.gather(*[fetch(video_id) for video_id in video_ids])
+
+
+class JsonlWriter:
+    """write 和 close 返回已经写入文件的视频 ID，调用方只把这些 ID 记入 checkpoint"""
+
+    def __init__(self, path: str):
+        self._file = open(path, "a", encoding="utf-8")
+
+    def write(self, records: List[dict]) -> List[str]:
+        for record in records:
+            self._file.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n")
+        self._file.flush()
+        return [record["video_id"] for record in records]
+
+    def close(self) -> List[str]:
+        self._file.close()
+        return []
+
+
+class ParquetWriter:
+    """每批结果写成一个 row group，每个分片文件写满 rows_per_file 行后关闭
+
+    Parquet 的 footer 在关闭时才写入，进程被杀死时未关闭的文件无法读取。分片先写到 .partial 文件，
+    关闭后再改名；write 和 close 只返回已关闭分片中的视频 ID。Parquet 文件不能追加，续传时写到新的分片。
+    """
+
+    def __init__(self, path: str, rows_per_file: int):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("`pyarrow` not installed. Please install using `pip install pyarrow`")
+        self._pa = pa
+        self._pq = pq
+        self._base, self._ext = os.path.splitext(path)
+        self._part = 0
+        self.rows_per_file = rows_per_file
+        self.path: Optional[str] = None
+        self._writer = None
+        # 当前分片中的视频 ID，分片关闭后才算导出完成
+        self._pending: List[str] = []
+        # captions 的结构取决于输出格式，统一保存为 JSON 字符串
+        self._schema = pa.schema([("video_id", pa.string()), ("language", pa.string()), ("captions", pa.string())])
+
+    def _open(self) -> None:
+        while True:
+            path = f"{self._base}.{self._part}{self._ext}" if self._part else f"{self._base}{self._ext}"
+            if not os.path.exists(path):
+                break
+            self._part += 1
+        self.path = path
+        # 之前被中断留下的同名 .partial 文件无法读取，直接覆盖
+        self._writer = self._pq.ParquetWriter(f"{path}.partial", self._schema, compression="zstd")
+
+    def _close_part(self) -> List[str]:
+        self._writer.close()
+        os.replace(f"{self.path}.partial", self.path)
+        self._writer = None
+        done, self._pending = self._pending, []
+        return done
+
+    def write(self, records: List[dict]) -> List[str]:
+        if self._writer is None:
+            self._open()
+        columns = {
+            "video_id": [record["video_id"] for record in records],
+            "language": [record.get("language") for record in records],
+            "captions": [json.dumps(record["captions"], ensure_ascii=False) for record in records],
+        }
+        self._writer.write_table(self._pa.table(columns, schema=self._schema))
+        self._pending.extend(columns["video_id"])
+        if len(self._pending) >= self.rows_per_file:
+            return self._close_part()
+        return []
+
+    def close(self) -> List[str]:
+        if self._writer is None:
+            return []
+        return self._close_part()
+
+
+class Progress:
+    """定期输出吞吐量和错误率"""
+
+    def __init__(self, total: int, skipped: int, interval: float = 5.0):
+        self.total = total
+        self.skipped = skipped
+        self.interval = interval
+        self.ok = 0
+        self.errors = 0
+        self.started = time.monotonic()
+        self._last_report = self.started
+        self._reported = -1
+
+    def update(self, ok: int, errors: int) -> None:
+        self.ok += ok
+        self.errors += errors
+        if time.monotonic() - self._last_report >= self.interval:
+            self.report()
+
+    def finish(self) -> None:
+        if self.ok + self.errors != self._reported:
+            self.report()
+
+    def report(self) -> None:
+        self._last_report = time.monotonic()
+        elapsed = self._last_report - self.started
+        done = self._reported = self.ok + self.errors
+        rate = done / elapsed if elapsed > 0 else 0.0
+        error_rate = self.errors / done if done else 0.0
+        remaining = self.total - done
+        eta = remaining / rate if rate > 0 else float("inf")
+        print(
+            f"[export] {done}/{self.total} 完成 (跳过 {self.skipped}), 成功 {self.ok}, 失败 {self.errors}, "
+            f"{rate:.1f} 个/秒, 错误率 {error_rate:.1%}, 预计剩余 {eta:.0f}s",
+            file=sys.stderr,
+            flush=True,
+        )
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Export transcripts for many YouTube videos")
+    parser.add_argument("input", help="file with one video URL or ID per line")
+    parser.add_argument("-o", "--output", required=True, help="output file, .jsonl or .parquet")
+    parser.add_argument("--languages", help="comma-separated preferred languages, e.g. en,ja")
+    parser.add_argument("--format", default="json", choices=FORMATS, help="caption format (default: json)")
+    parser.add_argument("--processes", type=int, default=multiprocessing.cpu_count(), help="worker processes")
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent fetches per process")
+    parser.add_argument("--chunk-size", type=int, default=50, help="videos per work unit")
+    parser.add_argument("--rows-per-file", type=int, default=10000, help="rows per Parquet part file")
+    parser.add_argument("--log-level", default="WARNING", help="log level for worker processes")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    languages = [language.strip() for language in args.languages.split(",")] if args.languages else None
+    checkpoint_path = f"{args.output}.checkpoint"
+    errors_path = f"{args.output}.errors.jsonl"
+
+    done = read_checkpoint(checkpoint_path)
+    video_ids = list(read_video_ids(args.input))
+    todo = [video_id for video_id in video_ids if video_id not in done]
+    progress = Progress(len(todo), len(video_ids) - len(todo))
+    if not todo:
+        print("[export] 没有需要导出的视频", file=sys.stderr)
+        return 0
+
+    if args.output.endswith(".parquet"):
+        writer = ParquetWriter(args.output, args.rows_per_file)
+    else:
+        writer = JsonlWriter(args.output)
+    errors = open(errors_path, "a", encoding="utf-8")
+    checkpoint = open(checkpoint_path, "a", encoding="utf-8")
+    pool = ProcessPoolExecutor(args.processes, initializer=_init_worker, initargs=(args.log_level,))
+    try:
+        futures = [
+            pool.submit(fetch_chunk, chunk, languages, args.format, args.concurrency)
+            for chunk in chunked(todo, args.chunk_size)
+        ]
+        for future in as_completed(futures):
+            records = future.result()
+            succeeded = [record for record in records if "error" not in record]
+            failed = [record for record in records if "error" in record]
+            exported = writer.write(succeeded) if succeeded else []
+            for record in failed:
+                errors.write(json.dumps(record, ensure_ascii=False) + "\n")
+            errors.flush()
+            # 结果落盘之后才记 checkpoint，中断时最多重复导出一批（Parquet 为一个分片）
+            checkpoint.write("".join(f"{video_id}\n" for video_id in exported))
+            checkpoint.flush()
+            progress.update(len(succeeded), len(failed))
+    except KeyboardInterrupt:
+        print("[export] 已中断，重新运行同样的命令即可继续", file=sys.stderr)
+        return 130
+    finally:
+        # 中断时不再等待排队中的批次
+        pool.shutdown(wait=True, cancel_futures=True)
+        checkpoint.write("".join(f"{video_id}\n" for video_id in writer.close()))
+        errors.close()
+        checkpoint.close()
+        progress.finish()
+    return 0 if progress.errors == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
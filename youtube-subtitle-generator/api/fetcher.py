@@ -0,0 +1,362 @@
+"""共享的异步出站 HTTP 层，所有对 YouTube 的请求都通过这里发出
+
+每个请求都有连接和读取超时；按 host 做令牌桶限流和熔断，429/5xx 和网络错误按带抖动的退避重试。
+"""
+import asyncio
+import logging
+import os
+import random
+import time
+from contextlib import asynccontextmanager
+from typing import Optional, Dict, Any, Callable, AsyncIterator
+from urllib.parse import urlsplit
+
+import httpx
+
+from metrics import UPSTREAM_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
+    "Accept-Language": "en-US,en;q=0.9,zh-CN;q=0.8,zh;q=0.7"
+}
+
+# 连接池大小可以通过环境变量调整
+MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", 100))
+MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", 20))
+KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", 30))
+
+# 超时（秒）：一个卡住的连接不能无限占用 worker
+CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", 3))
+READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", 10))
+POOL_TIMEOUT = float(os.getenv("HTTP_POOL_TIMEOUT", 5))
+
+# 每个 host 的令牌桶：每秒请求数和突发容量；排队超过 HTTP_RATE_MAX_WAIT 秒直接失败
+HOST_RATE = float(os.getenv("HTTP_HOST_RATE", 20))
+HOST_BURST = float(os.getenv("HTTP_HOST_BURST", 40))
+RATE_MAX_WAIT = float(os.getenv("HTTP_RATE_MAX_WAIT", 2))
+
+# 重试：只针对网络错误和下面这些状态码
+RETRIES = int(os.getenv("HTTP_RETRIES", 2))
+RETRY_BACKOFF = float(os.getenv("HTTP_RETRY_BACKOFF", 0.2))
+RETRY_MAX_DELAY = float(os.getenv("HTTP_RETRY_MAX_DELAY", 2))
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+# 熔断：连续失败次数达到阈值后打开，冷却时间过后放行一个探测请求
+BREAKER_THRESHOLD = int(os.getenv("HTTP_BREAKER_THRESHOLD", 5))
+BREAKER_COOLDOWN = float(os.getenv("HTTP_BREAKER_COOLDOWN", 30))
+
+# YouTube 的地址，压测时指向本地的替身服务（见 bench/）
+YOUTUBE_BASE_URL = os.getenv("YOUTUBE_BASE_URL", "https://www.youtube.com").rstrip("/")
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+class UpstreamUnavailable(Exception):
+    """Raised instead of calling a host whose breaker is open or whose rate limit is exhausted."""
+
+    def __init__(self, host: str, reason: str, retry_after: float):
+        super().__init__(f"Upstream {host} unavailable: {reason}")
+        self.host = host
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """按固定速率补充令牌，令牌不足时等待"""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self._updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self) -> float:
+        """取走一个令牌（可以预支），返回需要等待的秒数"""
+        self._refill()
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def refund(self) -> None:
+        self.tokens += 1
+
+
+class CircuitBreaker:
+    """closed -> open after consecutive failures -> half_open (one probe) after the cooldown."""
+
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.open_for = 0.0
+        self._probing = False
+
+    def retry_after(self) -> float:
+        return max(0.0, self.opened_at + self.open_for - time.monotonic())
+
+    def allow(self) -> bool:
+        if self.state == "open":
+            if self.retry_after() > 0:
+                return False
+            self.state = "half_open"
+        if self.state == "half_open":
+            if self._probing:
+                return False
+            self._probing = True
+        return True
+
+    def release_probe(self) -> None:
+        """探测请求没有得到结果（被取消或被限流）时让下一个请求继续探测"""
+        self._probing = False
+
+    def record_success(self) -> None:
+        self.state = "closed"
+        self.failures = 0
+        self._probing = False
+
+    def record_failure(self, retry_after: float = 0.0) -> None:
+        self.failures += 1
+        self._probing = False
+        if self.state == "half_open" or self.failures >= self.threshold:
+            if self.state != "open":
+                logger.warning(f"熔断打开，连续失败 {self.failures} 次")
+            self.state = "open"
+            self.opened_at = time.monotonic()
+            # 429 带 Retry-After 时至少等到它指定的时间
+            self.open_for = max(self.cooldown, retry_after)
+
+
+class HostScheduler:
+    """Token bucket, circuit breaker and counters for one upstream host."""
+
+    def __init__(self, host: str):
+        self.host = host
+        self.bucket = TokenBucket(HOST_RATE, HOST_BURST)
+        self.breaker = CircuitBreaker(BREAKER_THRESHOLD, BREAKER_COOLDOWN)
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+        self.rejected = 0
+
+    def reject(self, reason: str, retry_after: float) -> UpstreamUnavailable:
+        self.rejected += 1
+        UPSTREAM_REQUESTS.labels(self.host, "rejected").inc()
+        return UpstreamUnavailable(self.host, reason, retry_after)
+
+    async def acquire(self) -> None:
+        """通过熔断和限流检查后返回，否则抛出 UpstreamUnavailable"""
+        if not self.breaker.allow():
+            raise self.reject("circuit open", self.breaker.retry_after())
+        wait = self.bucket.reserve()
+        if wait > RATE_MAX_WAIT:
+            self.bucket.refund()
+            self.breaker.release_probe()
+            raise self.reject("rate limited", wait)
+        if wait > 0:
+            try:
+                await asyncio.sleep(wait)
+            except BaseException:
+                # 等待时被取消（例如对冲输掉的尝试、关闭进程），否则半开状态会一直认为探测还在进行
+                self.breaker.release_probe()
+                raise
+        self.requests += 1
+
+    def stats(self) -> dict:
+        self.bucket._refill()
+        return {
+            "state": self.breaker.state,
+            "consecutive_failures": self.breaker.failures,
+            "retry_after": round(self.breaker.retry_after(), 3) if self.breaker.state == "open" else 0.0,
+            "tokens": round(self.bucket.tokens, 2),
+            "requests": self.requests,
+            "retries": self.retries,
+            "failures": self.failures,
+            "rejected": self.rejected,
+        }
+
+
+_hosts: Dict[str, HostScheduler] = {}
+
+
+def get_host(url: str) -> HostScheduler:
+    host = urlsplit(url).hostname or ""
+    scheduler = _hosts.get(host)
+    if scheduler is None:
+        scheduler = _hosts[host] = HostScheduler(host)
+    return scheduler
+
+
+async def ensure_available(url: str) -> None:
+    """不经过本模块发出的请求（例如 youtube_transcript_api）也先检查熔断和限流
+
+    这类请求的结果不会反馈给熔断器，所以熔断没有完全关闭时直接拒绝，探测交给经过本模块的请求。
+    """
+    scheduler = get_host(url)
+    if scheduler.breaker.state != "closed":
+        raise scheduler.reject("circuit open", scheduler.breaker.retry_after())
+    await scheduler.acquire()
+
+
+def upstream_stats() -> dict:
+    return {host: scheduler.stats() for host, scheduler in _hosts.items()}
+
+
+def _retry_after(response: httpx.Response) -> float:
+    value = response.headers.get("Retry-After", "")
+    try:
+        return float(value)
+    except ValueError:
+        return 0.0
+
+
+def _backoff(attempt: int, retry_after: float = 0.0) -> float:
+    """带完全抖动的指数退避，Retry-After 更长时以它为准"""
+    delay = random.uniform(0, RETRY_BACKOFF * (2 ** attempt))
+    return min(RETRY_MAX_DELAY, max(delay, retry_after))
+
+
+def _http2_available() -> bool:
+    """HTTP/2 需要安装 h2，没有时退回 HTTP/1.1"""
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def get_client() -> httpx.AsyncClient:
+    """Return the shared pooled client, creating it on first use."""
+    global _client
+    if _client is None or _client.is_closed:
+        limits = httpx.Limits(
+            max_connections=MAX_CONNECTIONS,
+            max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=KEEPALIVE_EXPIRY,
+        )
+        timeout = httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT, pool=POOL_TIMEOUT)
+        http2 = _http2_available()
+        _client = httpx.AsyncClient(
+            http2=http2,
+            limits=limits,
+            timeout=timeout,
+            headers=DEFAULT_HEADERS,
+            follow_redirects=True,
+        )
+        logger.info(f"创建共享 HTTP 客户端, http2={http2}")
+    return _client
+
+
+async def close_client() -> None:
+    """Close the shared client and release pooled connections."""
+    global _client
+    if _client is not None and not _client.is_closed:
+        await _client.aclose()
+    _client = None
+
+
+async def send(url: str, params: Optional[Dict[str, Any]] = None,
+               headers: Optional[Dict[str, str]] = None, stream: bool = False) -> httpx.Response:
+    """Send a GET through the host's rate limit and breaker, retrying retryable failures.
+
+    Raises ``UpstreamUnavailable`` without calling the host when the breaker is
+    open or the rate limit queue is too long, and after the last attempt still
+    failed with a network error or a retryable status. Other statuses are
+    returned as-is. With ``stream=True`` the caller must close the response.
+    """
+    scheduler = get_host(url)
+    client = get_client()
+    request = client.build_request("GET", url, params=params, headers=headers)
+    attempt = 0
+    while True:
+        await scheduler.acquire()
+        try:
+            response = await client.send(request, stream=stream)
+        except httpx.TransportError as e:
+            # 超时、连接失败等网络错误
+            scheduler.failures += 1
+            scheduler.breaker.record_failure()
+            UPSTREAM_REQUESTS.labels(scheduler.host, "error").inc()
+            if attempt >= RETRIES:
+                raise UpstreamUnavailable(scheduler.host, type(e).__name__, scheduler.breaker.retry_after()) from e
+            logger.warning(f"请求 {scheduler.host} 失败: {type(e).__name__}，准备重试")
+            delay = _backoff(attempt)
+        except BaseException:
+            scheduler.breaker.release_probe()
+            raise
+        else:
+            if response.status_code not in RETRYABLE_STATUSES:
+                scheduler.breaker.record_success()
+                UPSTREAM_REQUESTS.labels(scheduler.host, "ok").inc()
+                return response
+            retry_after = _retry_after(response)
+            scheduler.failures += 1
+            scheduler.breaker.record_failure(retry_after)
+            UPSTREAM_REQUESTS.labels(scheduler.host, str(response.status_code)).inc()
+            if stream:
+                await response.aclose()
+            # Retry-After 比允许的最长退避还长时不再重试
+            if attempt >= RETRIES or retry_after > RETRY_MAX_DELAY:
+                raise UpstreamUnavailable(
+                    scheduler.host, f"HTTP {response.status_code}", max(retry_after, scheduler.breaker.retry_after())
+                )
+            logger.warning(f"请求 {scheduler.host} 返回 {response.status_code}，准备重试")
+            delay = _backoff(attempt, retry_after)
+        attempt += 1
+        scheduler.retries += 1
+        await asyncio.sleep(delay)
+
+
+def raise_for_status(response: httpx.Response) -> None:
+    """Raise for a response that is not a real answer from the host.
+
+    403 and 429 mean the host is blocking or throttling us, so they raise
+    ``UpstreamUnavailable`` like an open breaker does. Any other non-2xx status
+    raises ``httpx.HTTPStatusError``.
+    """
+    if response.status_code in (403, 429):
+        scheduler = get_host(str(response.request.url))
+        raise UpstreamUnavailable(
+            scheduler.host, f"HTTP {response.status_code}",
+            max(_retry_after(response), scheduler.breaker.retry_after()),
+        )
+    response.raise_for_status()
+
+
+async def fetch_text(url: str, params: Optional[Dict[str, Any]] = None,
+                     headers: Optional[Dict[str, str]] = None) -> str:
+    """GET 请求并返回响应文本，非 2xx 状态码会抛出异常（见 raise_for_status）"""
+    response = await send(url, params=params, headers=headers)
+    raise_for_status(response)
+    return response.text
+
+
+async def fetch_json(url: str, params: Optional[Dict[str, Any]] = None) -> Any:
+    """GET 请求并解析 JSON，非 2xx 状态码会抛出异常（见 raise_for_status）"""
+    response = await send(url, params=params)
+    raise_for_status(response)
+    return response.json()
+
+
+@asynccontextmanager
+async def stream_text(url: str, params: Optional[Dict[str, Any]] = None,
+                      headers: Optional[Dict[str, str]] = None) -> AsyncIterator[AsyncIterator[str]]:
+    """流式读取响应文本；提前退出 with 块会中止下载，非 2xx 状态码会抛出异常（见 raise_for_status）"""
+    response = await send(url, params=params, headers=headers, stream=True)
+    try:
+        raise_for_status(response)
+        yield response.aiter_text()
+    finally:
+        await response.aclose()
+
+
+async def run_blocking(func: Callable, *args, **kwargs) -> Any:
+    """在线程池中运行同步调用（例如 youtube_transcript_api），避免阻塞事件循环"""
+    return await asyncio.to_thread(func, *args, **kwargs)
@@ -0,0 +1,49 @@
+"""生产环境启动配置：gunicorn 管理多个 uvicorn worker
+
+    gunicorn -c gunicorn.conf.py main:app
+
+默认在 master 中预加载应用，fork 之后各 worker 共享已导入的模块；字幕和元数据缓存通过 SQLite 在 worker 之间共享。
+
+预加载时 HUP 只是用 master 中已导入的旧代码重新 fork worker，不会加载新代码。上线新代码时：
+向 master 发送 USR2 启动一个运行新代码的 master，新 worker 就绪后向旧 master 发送 WINCH 平滑停止旧 worker，
+确认无误后再发送 QUIT 让旧 master 退出。设置 GUNICORN_PRELOAD=false 时每个 worker 自己导入应用，HUP 即可加载新代码。
+"""
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+bind = f"{os.getenv('HOST', '0.0.0.0')}:{os.getenv('PORT', 8000)}"
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_class = "uvicorn.workers.UvicornWorker"
+
+# 在 fork 之前导入应用，重依赖只加载一次；连接池和 SQLite 连接都是在 worker 中首次使用时才创建
+preload_app = os.getenv("GUNICORN_PRELOAD", "true").lower() in ("1", "true", "yes")
+
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 60))
+# 重启、HUP 或 WINCH 时等待正在处理的请求完成的时间
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", 30))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", 5))
+# 定期重启 worker，加上抖动避免同时重启
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", 0))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", 100))
+
+loglevel = os.getenv("LOG_LEVEL", "info").lower()
+accesslog = os.getenv("GUNICORN_ACCESS_LOG")
+
+# Prometheus 多进程模式：各 worker 把指标写到同一个目录，/metrics 汇总后输出。
+# 必须在导入 prometheus_client 之前设置；HUP 会重新执行本文件，USR2 启动的新 master 继承环境变量，只在首次启动时清理目录
+if not os.getenv("_METRICS_DIR_READY"):
+    metrics_dir = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+    if metrics_dir:
+        shutil.rmtree(metrics_dir, ignore_errors=True)
+        os.makedirs(metrics_dir, exist_ok=True)
+    else:
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="youtube-api-metrics-")
+    os.environ["_METRICS_DIR_READY"] = "1"
+
+
+def child_exit(server, worker):
+    """worker 退出后删除它的 gauge 数据，避免已退出进程的值被计入"""
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
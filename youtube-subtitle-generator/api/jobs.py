@@ -0,0 +1,401 @@
+"""后台任务：长视频、播放列表和 URL 列表在 worker 池中处理，进度和结果保存在 SQLite 中
+
+任务 ID 由请求内容决定，重复提交同一请求会回到同一个任务：已完成的条目不会重新抓取，失败的条目重新排队。
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import time
+import uuid
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from cache import LazySQLite
+from fetcher import run_blocking
+
+logger = logging.getLogger(__name__)
+
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "jobs.db"))
+# 每个进程的任务 worker 数，以及每个任务内同时处理的视频数
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 2))
+JOB_ITEM_CONCURRENCY = int(os.getenv("JOB_ITEM_CONCURRENCY", 4))
+JOB_MAX_ITEMS = int(os.getenv("JOB_MAX_ITEMS", 5000))
+# 没有新任务通知时多久检查一次数据库（其他进程提交的任务、需要恢复的任务）
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", 2))
+# 运行中的任务超过这么久没有心跳，视为所在进程已退出，由其他 worker 接手
+JOB_STALE_AFTER = float(os.getenv("JOB_STALE_AFTER", 120))
+# 任务运行期间定期刷新心跳，间隔要明显短于 JOB_STALE_AFTER
+JOB_HEARTBEAT_INTERVAL = float(os.getenv("JOB_HEARTBEAT_INTERVAL", JOB_STALE_AFTER / 4))
+# 服务繁忙、上游限流或超时是暂时的，条目按指数退避重试，多次仍失败才记为 error
+JOB_ITEM_RETRIES = int(os.getenv("JOB_ITEM_RETRIES", 5))
+JOB_RETRY_BACKOFF = float(os.getenv("JOB_RETRY_BACKOFF", 2))
+JOB_RETRY_MAX_DELAY = 30.0
+RETRYABLE_STATUSES = (429, 503, 504)
+
+# 任务状态: queued, running, done, failed；条目状态: pending, done, error
+FINISHED = ("done", "failed")
+# 推送进度时按 updated_at 增量读取，重新读最近这段时间内的条目，防止同一时刻提交的条目被漏掉
+STREAM_OVERLAP = 1.0
+
+
+def job_id_for(spec: dict) -> str:
+    """相同的请求得到相同的任务 ID"""
+    raw = json.dumps(spec, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+
+
+class JobStore(LazySQLite):
+    """SQLite tables for jobs and their items, shared by every worker process.
+
+    Jobs are claimed with a single UPDATE that stamps a fresh owner token, so
+    two processes never run the same job; progress writes are filtered by that
+    token so a job taken over after a stall is not finished twice.
+    """
+
+    def __init__(self, path: str = JOBS_DB_PATH):
+        super().__init__(path, [
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, spec TEXT NOT NULL, status TEXT NOT NULL, total INTEGER, "
+            "error TEXT, owner TEXT, heartbeat REAL, created_at REAL NOT NULL, updated_at REAL NOT NULL)",
+            "CREATE TABLE IF NOT EXISTS job_items ("
+            "job_id TEXT NOT NULL, idx INTEGER NOT NULL, url TEXT NOT NULL, status TEXT NOT NULL, "
+            "result TEXT, updated_at REAL NOT NULL, PRIMARY KEY (job_id, idx))",
+        ], row_factory=sqlite3.Row)
+
+    def _execute(self, sql: str, params: tuple = ()) -> sqlite3.Cursor:
+        with self._lock:
+            conn = self._connect()
+            cursor = conn.execute(sql, params)
+            conn.commit()
+            return cursor
+
+    def _query(self, sql: str, params: tuple = ()) -> List[sqlite3.Row]:
+        with self._lock:
+            return self._connect().execute(sql, params).fetchall()
+
+    def create(self, job_id: str, spec: dict) -> bool:
+        """新建任务，已存在时返回 False"""
+        now = time.time()
+        cursor = self._execute(
+            "INSERT OR IGNORE INTO jobs (id, spec, status, created_at, updated_at) VALUES (?, ?, 'queued', ?, ?)",
+            (job_id, json.dumps(spec, ensure_ascii=False), now, now),
+        )
+        return cursor.rowcount == 1
+
+    def get(self, job_id: str) -> Optional[dict]:
+        rows = self._query("SELECT * FROM jobs WHERE id = ?", (job_id,))
+        if not rows:
+            return None
+        job = dict(rows[0])
+        job["spec"] = json.loads(job["spec"])
+        counts = self._query(
+            "SELECT status, COUNT(*) AS n FROM job_items WHERE job_id = ? GROUP BY status", (job_id,)
+        )
+        job["counts"] = {row["status"]: row["n"] for row in counts}
+        return job
+
+    def items(self, job_id: str, statuses: tuple = ("pending", "done", "error")) -> List[dict]:
+        placeholders = ",".join("?" for _ in statuses)
+        rows = self._query(
+            f"SELECT idx, url, status, result FROM job_items WHERE job_id = ? AND status IN ({placeholders}) "
+            "ORDER BY idx",
+            (job_id, *statuses),
+        )
+        return [
+            {"index": row["idx"], "url": row["url"], "status": row["status"],
+             "result": json.loads(row["result"]) if row["result"] else None}
+            for row in rows
+        ]
+
+    def finished_since(self, job_id: str, since: float, skip: set) -> List[tuple]:
+        """updated_at 不早于 since 的已完成条目，跳过 skip 中的序号，返回 (序号, 更新时间, 结果)"""
+        rows = self._query(
+            "SELECT idx, updated_at, result FROM job_items "
+            "WHERE job_id = ? AND status IN ('done', 'error') AND updated_at >= ? ORDER BY updated_at",
+            (job_id, since),
+        )
+        # 只解析还没推送过的结果
+        return [(row["idx"], row["updated_at"], json.loads(row["result"])) for row in rows if row["idx"] not in skip]
+
+    def claim(self) -> Optional[dict]:
+        """领取最早的排队任务，或心跳已过期的运行中任务"""
+        token = uuid.uuid4().hex
+        now = time.time()
+        self._execute(
+            "UPDATE jobs SET status = 'running', owner = ?, heartbeat = ?, updated_at = ? WHERE id = ("
+            "SELECT id FROM jobs WHERE status = 'queued' OR (status = 'running' AND heartbeat < ?) "
+            "ORDER BY created_at LIMIT 1)",
+            (token, now, now, now - JOB_STALE_AFTER),
+        )
+        rows = self._query("SELECT id FROM jobs WHERE owner = ? AND status = 'running'", (token,))
+        if not rows:
+            return None
+        job = self.get(rows[0]["id"])
+        job["owner"] = token
+        return job
+
+    def set_items(self, job_id: str, owner: str, urls: List[str]) -> None:
+        with self._lock:
+            conn = self._connect()
+            now = time.time()
+            conn.executemany(
+                "INSERT OR IGNORE INTO job_items (job_id, idx, url, status, updated_at) VALUES (?, ?, ?, 'pending', ?)",
+                [(job_id, index, url, now) for index, url in enumerate(urls)],
+            )
+            conn.execute(
+                "UPDATE jobs SET total = ?, heartbeat = ?, updated_at = ? WHERE id = ? AND owner = ?",
+                (len(urls), now, now, job_id, owner),
+            )
+            conn.commit()
+
+    def heartbeat(self, job_id: str, owner: str) -> bool:
+        """刷新心跳，任务已经被其他进程接手时返回 False"""
+        now = time.time()
+        cursor = self._execute(
+            "UPDATE jobs SET heartbeat = ? WHERE id = ? AND owner = ?", (now, job_id, owner)
+        )
+        return cursor.rowcount == 1
+
+    def finish_item(self, job_id: str, owner: str, index: int, result: dict) -> None:
+        with self._lock:
+            conn = self._connect()
+            now = time.time()
+            # 任务已经被其他进程接手时不再写入
+            cursor = conn.execute(
+                "UPDATE jobs SET heartbeat = ?, updated_at = ? WHERE id = ? AND owner = ?",
+                (now, now, job_id, owner),
+            )
+            if cursor.rowcount:
+                conn.execute(
+                    "UPDATE job_items SET status = ?, result = ?, updated_at = ? WHERE job_id = ? AND idx = ?",
+                    ("error" if "error" in result else "done", json.dumps(result, ensure_ascii=False),
+                     now, job_id, index),
+                )
+            conn.commit()
+
+    def finish(self, job_id: str, owner: str, status: str, error: Optional[str] = None) -> None:
+        now = time.time()
+        self._execute(
+            "UPDATE jobs SET status = ?, error = ?, owner = NULL, updated_at = ? WHERE id = ? AND owner = ?",
+            (status, error, now, job_id, owner),
+        )
+
+    def release(self, job_id: str, owner: str) -> None:
+        """进程正常退出时把未完成的任务放回队列，其他进程可以立即接手"""
+        self._execute(
+            "UPDATE jobs SET status = 'queued', owner = NULL, updated_at = ? WHERE id = ? AND owner = ?",
+            (time.time(), job_id, owner),
+        )
+
+    def requeue(self, job_id: str) -> bool:
+        """已结束的任务重新排队，失败的条目改回 pending；没有需要重做的内容时返回 False"""
+        with self._lock:
+            conn = self._connect()
+            now = time.time()
+            # 运行中或排队中的任务不用处理，它们的条目还会被继续处理
+            cursor = conn.execute(
+                "UPDATE job_items SET status = 'pending', result = NULL, updated_at = ? "
+                "WHERE job_id = ? AND status = 'error' "
+                "AND (SELECT status FROM jobs WHERE id = ?) IN ('done', 'failed')",
+                (now, job_id, job_id),
+            )
+            retry_items = cursor.rowcount
+            cursor = conn.execute(
+                "UPDATE jobs SET status = 'queued', error = NULL, updated_at = ? "
+                "WHERE id = ? AND (status = 'failed' OR (status = 'done' AND ? > 0))",
+                (now, job_id, retry_items),
+            )
+            conn.commit()
+            return cursor.rowcount == 1
+
+
+def summarize(job: dict) -> dict:
+    counts = job["counts"]
+    return {
+        "job_id": job["id"],
+        "status": job["status"],
+        "total": job["total"],
+        "done": counts.get("done", 0),
+        "failed": counts.get("error", 0),
+        "pending": counts.get("pending", 0),
+        "error": job["error"],
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"],
+    }
+
+
+class JobManager:
+    """Submit jobs and run them on a pool of background tasks.
+
+    ``expand(spec)`` turns a job spec into the list of video URLs, and
+    ``process(spec, index, url)`` returns one result dict (with an ``error``
+    key on failure). Both are registered by the app so this module does not
+    depend on ``YouTubeTools``.
+    Store calls run in the thread pool, so a locked database file stalls only
+    the job, never the event loop.
+    """
+
+    def __init__(self, store: JobStore):
+        self.store = store
+        self.expand: Optional[Callable[[dict], Awaitable[List[str]]]] = None
+        self.process: Optional[Callable[[dict, int, str], Awaitable[dict]]] = None
+        self._workers: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        # 本进程正在运行的任务 ID -> owner token
+        self._running: Dict[str, str] = {}
+
+    def register(self, expand: Callable[[dict], Awaitable[List[str]]],
+                 process: Callable[[dict, int, str], Awaitable[dict]]) -> None:
+        self.expand = expand
+        self.process = process
+
+    async def submit(self, spec: dict) -> dict:
+        """Create the job, or return the existing one for the same spec (requeuing failed items)."""
+        job_id = job_id_for(spec)
+        if await run_blocking(self.store.create, job_id, spec):
+            logger.info(f"新建任务: {job_id}")
+        elif await run_blocking(self.store.requeue, job_id):
+            logger.info(f"任务重新排队: {job_id}")
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return summarize(await run_blocking(self.store.get, job_id))
+
+    async def get(self, job_id: str, include_results: bool = False) -> Optional[dict]:
+        job = await run_blocking(self.store.get, job_id)
+        if job is None:
+            return None
+        summary = summarize(job)
+        if include_results:
+            items = await run_blocking(self.store.items, job_id, ("done", "error"))
+            summary["results"] = [item["result"] for item in items]
+        return summary
+
+    async def stream(self, job_id: str, poll_interval: float = 1.0) -> AsyncIterator[dict]:
+        """依次输出新完成的条目，任务结束时输出最终状态
+
+        每次轮询只读取上次之后完成的条目，查询和 JSON 解析在线程池中执行。
+        """
+        sent = set()
+        latest = 0.0
+        while True:
+            job = await run_blocking(self.store.get, job_id)
+            items = await run_blocking(self.store.finished_since, job_id, latest - STREAM_OVERLAP, sent)
+            for index, updated_at, result in items:
+                sent.add(index)
+                latest = max(latest, updated_at)
+                yield {"event": "item", **result}
+            summary = summarize(job)
+            if job["status"] in FINISHED:
+                yield {"event": "finished", **summary}
+                return
+            yield {"event": "progress", **summary}
+            await asyncio.sleep(poll_interval)
+
+    def start(self, workers: int = JOB_WORKERS) -> None:
+        self._wakeup = asyncio.Event()
+        self._workers = [asyncio.ensure_future(self._worker()) for _ in range(workers)]
+
+    async def stop(self) -> None:
+        # 未完成的任务放回队列，已完成的条目保存在数据库中，之后从中断处继续；
+        # 进程异常退出时则等心跳过期后由其他 worker 接手
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        for job_id, owner in list(self._running.items()):
+            await run_blocking(self.store.release, job_id, owner)
+        self._running.clear()
+        self.store.close()
+
+    async def _worker(self) -> None:
+        while True:
+            try:
+                job = await run_blocking(self.store.claim)
+            except sqlite3.Error as e:
+                logger.warning(f"领取任务失败: {str(e)}")
+                job = None
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), JOB_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            self._running[job["id"]] = job["owner"]
+            try:
+                await self._run(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"任务 {job['id']} 失败: {str(e)}")
+                await run_blocking(self.store.finish, job["id"], job["owner"], "failed", str(e))
+            del self._running[job["id"]]
+
+    async def _run(self, job: dict) -> None:
+        """处理任务，同时定期刷新心跳；任务被其他 worker 接手后停止处理"""
+        work = asyncio.ensure_future(self._run_items(job))
+        heartbeat = asyncio.ensure_future(self._heartbeat(job["id"], job["owner"]))
+        try:
+            await asyncio.wait((work, heartbeat), return_when=asyncio.FIRST_COMPLETED)
+            if not work.done():
+                logger.warning(f"任务 {job['id']} 已被其他 worker 接手，停止处理")
+                return
+            await work
+        finally:
+            for task in (work, heartbeat):
+                task.cancel()
+            await asyncio.gather(work, heartbeat, return_exceptions=True)
+
+    async def _heartbeat(self, job_id: str, owner: str) -> None:
+        """每 JOB_HEARTBEAT_INTERVAL 秒刷新一次心跳，直到任务不再属于本 worker"""
+        while True:
+            await asyncio.sleep(JOB_HEARTBEAT_INTERVAL)
+            try:
+                if not await run_blocking(self.store.heartbeat, job_id, owner):
+                    return
+            except sqlite3.Error as e:
+                logger.warning(f"刷新任务 {job_id} 心跳失败: {str(e)}")
+
+    async def _run_items(self, job: dict) -> None:
+        job_id, owner, spec = job["id"], job["owner"], job["spec"]
+        if job["total"] is None:
+            urls = await self.expand(spec)
+            if not urls:
+                await run_blocking(self.store.finish, job_id, owner, "failed", "No videos found")
+                return
+            if len(urls) > JOB_MAX_ITEMS:
+                await run_blocking(
+                    self.store.finish, job_id, owner, "failed", f"Too many videos, at most {JOB_MAX_ITEMS} are allowed"
+                )
+                return
+            await run_blocking(self.store.set_items, job_id, owner, urls)
+
+        # 恢复运行时只处理还没完成的条目
+        pending = iter(await run_blocking(self.store.items, job_id, ("pending",)))
+        logger.info(f"开始处理任务 {job_id}")
+
+        async def worker():
+            for item in pending:
+                result = await self._process(spec, item["index"], item["url"])
+                await run_blocking(self.store.finish_item, job_id, owner, item["index"], result)
+
+        await asyncio.gather(*[worker() for _ in range(JOB_ITEM_CONCURRENCY)])
+        await run_blocking(self.store.finish, job_id, owner, "done")
+        logger.info(f"任务完成: {job_id}")
+
+    async def _process(self, spec: dict, index: int, url: str) -> dict:
+        """处理单个条目，暂时性错误等待后重试；重试期间心跳照常刷新，任务不会被当作失联"""
+        for attempt in range(JOB_ITEM_RETRIES + 1):
+            result = await self.process(spec, index, url)
+            status_code = result.get("error", {}).get("status_code")
+            if status_code not in RETRYABLE_STATUSES or attempt == JOB_ITEM_RETRIES:
+                return result
+            delay = min(JOB_RETRY_MAX_DELAY, JOB_RETRY_BACKOFF * 2 ** attempt)
+            logger.info(f"条目 {index} 暂时失败 ({status_code})，{delay:.0f}s 后重试: {url}")
+            await asyncio.sleep(delay)
+        return result
+
+
+jobs = JobManager(JobStore())
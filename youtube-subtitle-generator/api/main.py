@@ -1,30 +1,98 @@
+import asyncio
 import json
 import os
 import logging
+import math
 import re
-import requests
-from urllib.parse import urlparse, parse_qs, urlencode
-from urllib.request import urlopen
-from typing import Optional, List
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from urllib.parse import urlparse, parse_qs
+from typing import Optional, List, Dict, Set, Tuple, AsyncIterator, Literal
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, Response
 from pydantic import BaseModel
+import httpx
 import uvicorn
 
-# 配置日志
-logging.basicConfig(level=logging.INFO, 
+from admission import admission
+from cache import cache, TRANSCRIPT_CACHE_TTL, METADATA_CACHE_TTL, METADATA_STALE_TTL, TRACK_INDEX_TTL, NEGATIVE_CACHE_TTL
+from compression import encoded_responses
+from fetcher import (
+    fetch_text, fetch_json, close_client, ensure_available, upstream_stats, UpstreamUnavailable,
+    YOUTUBE_BASE_URL,
+)
+from jobs import jobs, JOB_MAX_ITEMS
+from metrics import stage, record_strategy, should_dump_payload, render_metrics, REQUEST_LATENCY
+from search import search_index
+from singleflight import singleflight
+from strategies import strategies, NoSubtitles
+from timedtext import parse_timedtext
+from transcript import Transcript, MEDIA_TYPES, align_transcripts, merge_cues
+from watchpage import fetch_caption_tracks, fetch_playlist_video_ids, build_track_index, select_track, track_url
+
+# 配置日志，生产环境默认 INFO，排查问题时可设置 LOG_LEVEL=DEBUG
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper(), 
                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
+# httpx 默认为每个出站请求输出一条 INFO 日志
+logging.getLogger("httpx").setLevel(os.getenv("HTTPX_LOG_LEVEL", "WARNING").upper())
+
+# youtube_transcript_api 内部的 requests 调用没有超时，只能限制等待它的时间
+FALLBACK_TIMEOUT = float(os.getenv("FALLBACK_TIMEOUT", 15))
+# 它在单独的小线程池中运行，卡住的调用不会占满压缩和检索共用的默认线程池
+FALLBACK_THREADS = int(os.getenv("FALLBACK_THREADS", 4))
+# youtube_transcript_api 总是访问真实的 YouTube，压测时需要关闭
+FALLBACK_ENABLED = os.getenv("FALLBACK_ENABLED", "true").lower() in ("1", "true", "yes")
+
+# 批量接口的默认并发数和上限
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", 8))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", 32))
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", 1000))
+# 批量元数据接口中同时请求 oEmbed 的视频数，只有缓存中没有的视频才会请求
+METADATA_BATCH_CONCURRENCY = int(os.getenv("METADATA_BATCH_CONCURRENCY", 8))
+
+_VIDEO_ID = re.compile(r"[\w-]{11}")
+# 后台刷新过期元数据的任务，保留引用以免被垃圾回收
+_metadata_refreshes: Set[asyncio.Task] = set()
+
+# 合并时间戳时的默认窗口长度（秒，句子模式下为单句最长时长）和默认章节数
+MERGE_WINDOW = float(os.getenv("MERGE_WINDOW", 30))
+MERGE_CHAPTERS = int(os.getenv("MERGE_CHAPTERS", 10))
+
+_fallback_executor = ThreadPoolExecutor(max_workers=FALLBACK_THREADS, thread_name_prefix="fallback")
+# 线程池自带的队列没有上限，用信号量限制提交的调用数；线程真正结束后才释放名额
+_fallback_slots = threading.BoundedSemaphore(FALLBACK_THREADS)
 
 try:
-    from youtube_transcript_api import YouTubeTranscriptApi
+    from youtube_transcript_api import YouTubeTranscriptApi, TranscriptsDisabled, NoTranscriptFound, NoTranscriptAvailable
 except ImportError:
     raise ImportError(
         "`youtube_transcript_api` not installed. Please install using `pip install youtube_transcript_api`"
     )
 
-app = FastAPI(title="YouTube Tools API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 后台任务 worker 在每个进程中启动，通过 SQLite 领取任务
+    jobs.start()
+    search_index.start()
+    cache.start()
+    yield
+    await jobs.stop()
+    await search_index.stop()
+    for task in list(_metadata_refreshes):
+        task.cancel()
+    await cache.stop()
+    # 关闭共享连接池和 SQLite 连接
+    await close_client()
+    cache.close()
+    _fallback_executor.shutdown(wait=False, cancel_futures=True)
+
+app = FastAPI(title="YouTube Tools API", lifespan=lifespan)
 
 # 添加 CORS 中间件
 app.add_middleware(
@@ -36,6 +104,27 @@ app.add_middleware(
     expose_headers=["*"],
 )
 
+async def run_fallback(func, *args):
+    """Run a blocking youtube_transcript_api call on the fallback pool, waiting at most FALLBACK_TIMEOUT.
+
+    Raises 503 when every fallback thread is still busy, for example stuck on a
+    call that never returns.
+    """
+    if not _fallback_slots.acquire(blocking=False):
+        raise HTTPException(
+            status_code=503,
+            detail="All youtube_transcript_api threads are busy",
+            headers={"Retry-After": str(max(1, math.ceil(FALLBACK_TIMEOUT)))},
+        )
+    try:
+        future = _fallback_executor.submit(func, *args)
+    except BaseException:
+        _fallback_slots.release()
+        raise
+    future.add_done_callback(lambda _: _fallback_slots.release())
+    # 超时只是不再等待，线程仍在运行并占着名额
+    return await asyncio.wait_for(asyncio.wrap_future(future), FALLBACK_TIMEOUT)
+
 class YouTubeTools:
     @staticmethod
     def get_youtube_video_id(url: str) -> Optional[str]:
@@ -56,464 +145,843 @@ class YouTubeTools:
         return None
 
     @staticmethod
-    def get_video_data(url: str) -> dict:
-        """Function to get video data from a YouTube URL."""
+    def require_video_id(url: str) -> str:
+        """解析 URL 中的视频 ID，无效时抛出 400"""
         if not url:
             raise HTTPException(status_code=400, detail="No URL provided")
 
         try:
-            video_id = YouTubeTools.get_youtube_video_id(url)
+            with stage("url_parse"):
+                video_id = YouTubeTools.get_youtube_video_id(url)
             if not video_id:
                 raise HTTPException(status_code=400, detail="Invalid YouTube URL")
         except Exception:
             raise HTTPException(status_code=400, detail="Error getting video ID from URL")
+        return video_id
+
+    @staticmethod
+    async def get_video_data(url: str) -> dict:
+        """Function to get video data from a YouTube URL."""
+        video_id = YouTubeTools.require_video_id(url)
 
+        cached = YouTubeTools.cached_video_data([video_id]).get(video_id)
+        if cached is not None:
+            if "error" in cached:
+                raise HTTPException(**cached["error"])
+            return cached
+        return await YouTubeTools.load_video_data(video_id)
+
+    @staticmethod
+    def cached_video_data(video_ids: List[str]) -> Dict[str, dict]:
+        """Look up cached metadata for many videos in one pass.
+
+        Entries that expired less than ``METADATA_STALE_TTL`` ago are returned
+        as they are and refreshed in the background. Videos missing from the
+        result have to be fetched.
+        """
+        keys = {f"metadata:{video_id}": video_id for video_id in video_ids}
+        found = {}
+        for cache_key, (value, fresh) in cache.get_many(keys, max_stale=METADATA_STALE_TTL).items():
+            if not fresh:
+                # 过期的失败结果不再使用，重新请求
+                if "error" in value:
+                    continue
+                YouTubeTools.refresh_video_data(keys[cache_key], cache_key)
+            found[keys[cache_key]] = value
+        return found
+
+    @staticmethod
+    async def load_video_data(video_id: str) -> dict:
+        """缓存未命中时从 oEmbed 获取，同一视频的并发请求只调用一次 oEmbed"""
+        cache_key = f"metadata:{video_id}"
+        try:
+            return await singleflight.do(
+                ("metadata", video_id), lambda: YouTubeTools.fetch_video_data(video_id, cache_key)
+            )
+        except UpstreamUnavailable as e:
+            return YouTubeTools.serve_stale(cache_key, e)
+
+    @staticmethod
+    def refresh_video_data(video_id: str, cache_key: str) -> None:
+        """在后台刷新过期的元数据，和前台请求共用 singleflight，同一视频同时只请求一次"""
+        async def refresh():
+            try:
+                await singleflight.do(
+                    ("metadata", video_id), lambda: YouTubeTools.fetch_video_data(video_id, cache_key)
+                )
+            except Exception as e:
+                logger.warning(f"后台刷新元数据失败: {video_id}, 错误: {str(e)}")
+
+        task = asyncio.ensure_future(refresh())
+        _metadata_refreshes.add(task)
+        task.add_done_callback(_metadata_refreshes.discard)
+
+    @staticmethod
+    async def get_video_data_batch(videos: List[str], concurrency: int) -> List[dict]:
+        """Metadata for many videos (URLs or IDs), in request order.
+
+        Cached and stale entries come straight from one cache lookup. Only the
+        misses are fetched from oEmbed, at most ``concurrency`` at a time.
+        Errors are reported per item instead of failing the whole batch.
+        """
+        video_ids = [
+            video if _VIDEO_ID.fullmatch(video) else YouTubeTools.get_youtube_video_id(video) for video in videos
+        ]
+        found: Dict[str, dict] = YouTubeTools.cached_video_data([video_id for video_id in video_ids if video_id])
+        misses = [video_id for video_id in dict.fromkeys(video_ids) if video_id and video_id not in found]
+        pending = iter(misses)
+
+        async def worker():
+            # 和 stream_captions_batch 一样，同时请求的视频数不超过 worker 数
+            for video_id in pending:
+                try:
+                    found[video_id] = await YouTubeTools.load_video_data(video_id)
+                except HTTPException as e:
+                    found[video_id] = {"error": {"status_code": e.status_code, "detail": e.detail}}
+                except Exception as e:
+                    logger.error(f"批量元数据请求中的视频失败: {video_id}, 错误: {str(e)}")
+                    found[video_id] = {"error": {"status_code": 500, "detail": str(e)}}
+
+        if misses:
+            logger.debug(f"批量元数据: 缓存命中 {len(found)} 个, 需要请求 {len(misses)} 个")
+        await asyncio.gather(*[worker() for _ in range(min(concurrency, len(misses)))])
+
+        results = []
+        for index, video_id in enumerate(video_ids):
+            result = {"index": index, "video_id": video_id}
+            value = found.get(video_id) if video_id else {"error": {"status_code": 400, "detail": "Invalid YouTube URL"}}
+            if "error" in value:
+                result["error"] = value["error"]
+            else:
+                result["video_data"] = value
+            results.append(result)
+        return results
+
+    @staticmethod
+    def serve_stale(cache_key: str, error: UpstreamUnavailable, decode=None):
+        """上游不可用时返回过期的缓存；没有可用的旧数据时返回 503 并带上 Retry-After"""
+        stale = cache.get_stale(cache_key, decode=decode)
+        if stale is not None and "error" not in stale:
+            logger.warning(f"{error}，返回过期缓存: {cache_key}")
+            return stale
+        raise HTTPException(
+            status_code=503,
+            detail=str(error),
+            headers={"Retry-After": str(max(1, math.ceil(error.retry_after)))},
+        )
+
+    @staticmethod
+    async def fetch_video_data(video_id: str, cache_key: str) -> dict:
+        """从 oEmbed 获取视频元数据并写入缓存"""
         try:
             params = {"format": "json", "url": f"https://www.youtube.com/watch?v={video_id}"}
-            oembed_url = "https://www.youtube.com/oembed"
-            query_string = urlencode(params)
-            full_url = oembed_url + "?" + query_string
-
-            with urlopen(full_url) as response:
-                response_text = response.read()
-                video_data = json.loads(response_text.decode())
-                clean_data = {
-                    "title": video_data.get("title"),
-                    "author_name": video_data.get("author_name"),
-                    "author_url": video_data.get("author_url"),
-                    "type": video_data.get("type"),
-                    "height": video_data.get("height"),
-                    "width": video_data.get("width"),
-                    "version": video_data.get("version"),
-                    "provider_name": video_data.get("provider_name"),
-                    "provider_url": video_data.get("provider_url"),
-                    "thumbnail_url": video_data.get("thumbnail_url"),
-                }
-                return clean_data
+            oembed_url = f"{YOUTUBE_BASE_URL}/oembed"
+
+            async with admission.slot():
+                video_data = await fetch_json(oembed_url, params=params)
+            clean_data = {
+                "title": video_data.get("title"),
+                "author_name": video_data.get("author_name"),
+                "author_url": video_data.get("author_url"),
+                "type": video_data.get("type"),
+                "height": video_data.get("height"),
+                "width": video_data.get("width"),
+                "version": video_data.get("version"),
+                "provider_name": video_data.get("provider_name"),
+                "provider_url": video_data.get("provider_url"),
+                "thumbnail_url": video_data.get("thumbnail_url"),
+            }
+            cache.set(cache_key, clean_data, METADATA_CACHE_TTL)
+            return clean_data
+        except (HTTPException, UpstreamUnavailable):
+            raise
+        except httpx.HTTPStatusError as e:
+            # 视频不存在、私有或不允许嵌入时 oEmbed 返回 4xx，短时间内不再请求
+            # （403 和 429 在 raise_for_status 中已转为 UpstreamUnavailable，会返回过期缓存）
+            status_code = e.response.status_code
+            if 400 <= status_code < 500:
+                detail = f"Video not found or not embeddable: {video_id}"
+                cache.set_negative(cache_key, 404, detail)
+                raise HTTPException(status_code=404, detail=detail)
+            raise HTTPException(status_code=500, detail=f"Error getting video data: {str(e)}")
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Error getting video data: {str(e)}")
 
     @staticmethod
-    def get_video_captions(url: str, languages: Optional[List[str]] = None) -> str:
-        """Get captions from a YouTube video."""
-        if not url:
-            raise HTTPException(status_code=400, detail="No URL provided")
+    async def get_transcript(url: str, languages: Optional[List[str]] = None) -> Transcript:
+        """Fetch and parse the transcript once; every output format is rendered from it.
+
+        Results, including "no subtitles" 404s, are cached per video and language list.
+        """
+        video_id = YouTubeTools.require_video_id(url)
+
+        cache_key = YouTubeTools.transcript_cache_key(video_id, languages)
+        cached = cache.get(cache_key, decode=YouTubeTools.decode_cached_transcript)
+        if cached is not None:
+            logger.debug(f"字幕缓存命中: {cache_key}")
+            if "error" in cached:
+                raise HTTPException(**cached["error"])
+            transcript = cached["transcript"]
+        else:
+            # 同一视频、同一语言偏好的并发请求共享一次上游抓取和解析
+            try:
+                transcript = await singleflight.do(
+                    ("transcript", video_id, tuple(languages or ())),
+                    lambda: YouTubeTools.fetch_and_cache_transcript(video_id, languages, cache_key),
+                )
+            except UpstreamUnavailable as e:
+                transcript = YouTubeTools.serve_stale(
+                    cache_key, e, decode=YouTubeTools.decode_cached_transcript
+                )["transcript"]
+
+        # 加入全文检索索引（后台写入，已索引过的会被跳过）
+        search_index.submit(video_id, transcript)
+        return transcript
 
+    @staticmethod
+    async def fetch_and_cache_transcript(video_id: str, languages: Optional[List[str]], cache_key: str) -> Transcript:
+        """从上游获取字幕并写入缓存，404 结果按较短的 TTL 缓存"""
         try:
-            video_id = YouTubeTools.get_youtube_video_id(url)
-            if not video_id:
-                raise HTTPException(status_code=400, detail="Invalid YouTube URL")
-        except Exception:
-            raise HTTPException(status_code=400, detail="Error getting video ID from URL")
+            # 只有缓存未命中才占用准入名额，缓存命中的请求不会排在冷请求后面
+            async with admission.slot():
+                transcript = await YouTubeTools.load_transcript(video_id, languages)
+        except NoSubtitles as e:
+            # 确认没有字幕的视频短时间内不再请求上游；其他错误可能是暂时的，不缓存
+            cache.set_negative(cache_key, e.status_code, e.detail)
+            raise
+        cache.set(cache_key, {"transcript": transcript}, TRANSCRIPT_CACHE_TTL)
+        return transcript
+
+    @staticmethod
+    def decode_cached_transcript(value: dict) -> dict:
+        """SQLite 中读出的字幕缓存还原成 Transcript"""
+        if "transcript" in value:
+            return {"transcript": Transcript.from_cache(value["transcript"])}
+        return value
 
+    @staticmethod
+    def transcript_cache_key(video_id: str, languages: Optional[List[str]] = None) -> str:
+        return f"transcript:{video_id}:{','.join(languages or [])}"
+
+    @staticmethod
+    async def load_transcript(video_id: str, languages: Optional[List[str]] = None) -> Transcript:
+        """从上游获取字幕：按各策略最近的成功率和耗时决定先直接抓取还是先用 youtube_transcript_api"""
         try:
-            # 记录更详细的信息
-            logger.info(f"尝试获取视频 ID: {video_id} 的字幕")
-            
-            # 如果没有指定语言，尝试多种常见语言
-            if not languages:
-                languages = ["en", "zh", "zh-Hans", "zh-Hant", "zh-CN", "zh-TW", "ja", "ko", "es", "fr", "de", "ru", "pt", "it"]
-                logger.info(f"未指定语言，将尝试以下语言: {languages}")
-            
-            # 首先尝试直接从 YouTube 获取字幕
-            try:
-                logger.info("尝试直接从 YouTube 获取字幕")
-                captions_text = YouTubeTools.get_captions_direct(video_id)
-                if captions_text:
-                    logger.info("成功直接从 YouTube 获取字幕")
-                    return captions_text
-                logger.warning("直接获取字幕失败，尝试使用 youtube_transcript_api")
-            except Exception as direct_e:
-                logger.warning(f"直接获取字幕失败: {str(direct_e)}，尝试使用 youtube_transcript_api")
-            
-            try:
-                # 尝试使用 youtube_transcript_api
-                logger.info(f"尝试使用指定语言获取字幕: {languages}")
-                captions = YouTubeTranscriptApi.get_transcript(video_id, languages=languages)
-                logger.info(f"成功获取字幕，语言: {languages}")
-            except Exception as e:
-                # 如果指定语言失败，尝试获取任何可用的字幕
-                logger.warning(f"使用指定语言获取字幕失败: {str(e)}，尝试获取任何可用的字幕")
-                try:
-                    transcript_list = YouTubeTranscriptApi.list_transcripts(video_id)
-                    logger.info(f"可用的字幕列表: {[tr.language_code for tr in transcript_list]}")
-                    
-                    # 获取第一个可用的字幕
-                    transcript = transcript_list.find_transcript(languages)
-                    if not transcript:
-                        # 如果找不到指定语言，获取自动生成的字幕
-                        transcript = next(transcript_list._manually_created_transcripts.values().__iter__(), None)
-                        if not transcript:
-                            # 如果没有手动创建的字幕，获取自动生成的字幕
-                            transcript = next(transcript_list._generated_transcripts.values().__iter__(), None)
-                    
-                    if transcript:
-                        logger.info(f"找到可用字幕，语言: {transcript.language_code}")
-                        captions = transcript.fetch()
-                    else:
-                        raise Exception("No available transcripts found")
-                except Exception as inner_e:
-                    logger.error(f"获取任何可用字幕失败: {str(inner_e)}")
-                    raise HTTPException(
-                        status_code=404,
-                        detail=f"This video does not have available subtitles. Error: {str(inner_e)}"
-                    )
-            
-            if captions:
-                return " ".join(line["text"] for line in captions)
-            return "No captions found for video"
+            logger.debug(f"尝试获取视频 ID: {video_id} 的字幕")
+            return await strategies.run(video_id, languages)
+        except (HTTPException, UpstreamUnavailable):
+            raise
         except Exception as e:
             error_msg = str(e)
             logger.error(f"获取字幕时出错: {error_msg}")
             if "Subtitles are disabled" in error_msg:
-                raise HTTPException(
-                    status_code=404,
-                    detail="This video does not have subtitles enabled. Please try another video or contact the video owner to enable subtitles."
+                raise NoSubtitles(
+                    "This video does not have subtitles enabled. Please try another video or contact the video owner to enable subtitles."
                 )
             raise HTTPException(status_code=500, detail=error_msg)
 
     @staticmethod
-    def get_captions_direct(video_id: str) -> Optional[str]:
-        """直接从 YouTube 获取字幕，不使用第三方库"""
-        try:
-            # 获取视频页面
-            url = f"https://www.youtube.com/watch?v={video_id}"
-            headers = {
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
-                "Accept-Language": "en-US,en;q=0.9,zh-CN;q=0.8,zh;q=0.7"
-            }
-            logger.info(f"正在获取视频页面: {url}")
-            response = requests.get(url, headers=headers)
-            html_content = response.text
-            
-            # 保存一部分 HTML 用于调试
-            debug_html = html_content[:10000] + "..." if len(html_content) > 10000 else html_content
-            logger.info(f"获取到的 HTML 前 10000 字符: {debug_html}")
-            
-            # 尝试多种方式提取字幕 URL
-            caption_url = None
-            
-            # 方法 1: 使用正则表达式查找 captionTracks
-            caption_url_match = re.search(r'"captionTracks":\[(.*?)\]', html_content)
-            if caption_url_match:
-                caption_data = caption_url_match.group(1)
-                logger.info(f"找到字幕轨道数据: {caption_data[:200]}...")
-                
-                base_url_match = re.search(r'"baseUrl":"(.*?)"', caption_data)
-                if base_url_match:
-                    caption_url = base_url_match.group(1).replace('\\u0026', '&')
-                    logger.info(f"方法 1 找到字幕 URL: {caption_url[:100]}...")
+    async def get_video_captions(url: str, languages: Optional[List[str]] = None, format: str = "text"):
+        """Get captions from a YouTube video, as plain text unless another format is requested."""
+        transcript = await YouTubeTools.get_transcript(url, languages)
+        return YouTubeTools.render_captions(transcript, format)
+
+    @staticmethod
+    def render_captions(transcript: Transcript, format: str = "text"):
+        if format == "text" and not len(transcript):
+            return "No captions found for video"
+        with stage("render"):
+            return transcript.render(format)
+
+    @staticmethod
+    def render_timestamps(transcript: Transcript, format: str = "timestamps", merge: Optional[str] = None,
+                          window: Optional[float] = None, chapters: Optional[int] = None):
+        """按需先把字幕合并为时间窗口、句子或章节，再渲染"""
+        with stage("render"):
+            if merge:
+                transcript = merge_cues(
+                    transcript, merge, window or MERGE_WINDOW, chapters or MERGE_CHAPTERS
+                )
+            return transcript.render(format)
+
+    @staticmethod
+    async def get_aligned_transcripts(url: str, languages: Optional[List[str]] = None) -> dict:
+        """Fetch every requested language concurrently and align the tracks on cue start times.
+
+        All languages share one cached track index, so the watch page is fetched
+        at most once and only the timedtext requests run in parallel.
+        """
+        if not languages:
+            raise HTTPException(status_code=400, detail="languages is required when multi_language is set")
+        languages = list(dict.fromkeys(languages))
+
+        results = await asyncio.gather(
+            *[YouTubeTools.get_transcript(url, [language]) for language in languages],
+            return_exceptions=True,
+        )
+        tracks = []
+        errors = {}
+        for language, result in zip(languages, results):
+            if isinstance(result, HTTPException):
+                errors[language] = {"status_code": result.status_code, "detail": result.detail}
+            elif isinstance(result, Exception):
+                errors[language] = {"status_code": 500, "detail": str(result)}
             else:
-                logger.warning("方法 1 未找到字幕轨道信息")
-            
-            # 方法 2: 使用正则表达式查找 playerCaptionsTracklistRenderer
-            if not caption_url:
-                track_list_match = re.search(r'"playerCaptionsTracklistRenderer":(.*?),"videoDetails"', html_content)
-                if track_list_match:
-                    track_list_data = track_list_match.group(1)
-                    logger.info(f"找到字幕轨道列表数据: {track_list_data[:200]}...")
-                    
-                    base_url_match = re.search(r'"baseUrl":"(.*?)"', track_list_data)
-                    if base_url_match:
-                        caption_url = base_url_match.group(1).replace('\\u0026', '&')
-                        logger.info(f"方法 2 找到字幕 URL: {caption_url[:100]}...")
-                else:
-                    logger.warning("方法 2 未找到字幕轨道列表信息")
-            
-            # 方法 3: 直接构造字幕 URL
-            if not caption_url:
-                logger.info("尝试方法 3: 直接构造字幕 URL")
-                caption_url = f"https://www.youtube.com/api/timedtext?lang=en&v={video_id}"
-                logger.info(f"方法 3 构造的字幕 URL: {caption_url}")
-            
-            if not caption_url:
-                logger.warning("所有方法都未找到字幕 URL")
-                return None
-                
-            # 获取字幕内容
-            logger.info(f"正在获取字幕内容: {caption_url}")
-            caption_response = requests.get(caption_url)
-            caption_xml = caption_response.text
-            
-            # 记录字幕 XML 用于调试
-            debug_xml = caption_xml[:5000] + "..." if len(caption_xml) > 5000 else caption_xml
-            logger.info(f"获取到的字幕 XML: {debug_xml}")
-            
-            # 解析 XML 提取文本
-            text_parts = re.findall(r'<text[^>]*>(.*?)</text>', caption_xml)
-            if not text_parts:
-                logger.warning("未找到字幕文本，尝试其他格式")
-                # 尝试 JSON 格式
-                try:
-                    json_data = json.loads(caption_xml)
-                    if 'events' in json_data:
-                        text_parts = [event.get('segs', [{}])[0].get('utf8', '') for event in json_data['events'] if 'segs' in event]
-                        logger.info(f"从 JSON 格式中提取到 {len(text_parts)} 个文本片段")
-                except Exception as json_e:
-                    logger.error(f"解析 JSON 格式失败: {str(json_e)}")
-            
-            if not text_parts:
-                logger.warning("未找到字幕文本")
-                return None
-                
-            # 清理 HTML 实体
-            cleaned_parts = [part.replace('&amp;', '&').replace('&lt;', '<').replace('&gt;', '>').replace('&quot;', '"') for part in text_parts]
-            
-            result = " ".join(cleaned_parts)
-            logger.info(f"成功提取字幕，总长度: {len(result)} 字符")
-            return result
+                tracks.append((language, result))
+        if not tracks:
+            # 所有语言都失败时返回第一个错误
+            raise HTTPException(**errors[languages[0]])
+
+        return {
+            "languages": [language for language, _ in tracks],
+            "cues": align_transcripts(tracks),
+            "errors": errors,
+        }
+
+    @staticmethod
+    async def get_video_bundle(url: str, languages: Optional[List[str]] = None) -> dict:
+        """Get metadata, captions and timestamps with a single transcript fetch.
+
+        Captions and timestamps come from the transcript, so its errors fail the
+        request. A metadata failure (for example a video that does not allow
+        embedding) only sets ``video_data`` to null and is reported in ``errors``.
+        """
+        video_data, transcript = await asyncio.gather(
+            YouTubeTools.get_video_data(url),
+            YouTubeTools.get_transcript(url, languages),
+            return_exceptions=True,
+        )
+        if isinstance(transcript, BaseException):
+            raise transcript
+        errors = {}
+        if isinstance(video_data, HTTPException):
+            errors["video_data"] = {"status_code": video_data.status_code, "detail": video_data.detail}
+            video_data = None
+        elif isinstance(video_data, Exception):
+            logger.error(f"合并请求中的元数据获取失败: {url}, 错误: {str(video_data)}")
+            errors["video_data"] = {"status_code": 500, "detail": str(video_data)}
+            video_data = None
+        elif isinstance(video_data, BaseException):
+            raise video_data
+        return {
+            "video_data": video_data,
+            "captions": transcript.render_text() if len(transcript) else "No captions found for video",
+            "timestamps": transcript.render_timestamps(),
+            "errors": errors,
+        }
+
+    @staticmethod
+    async def caption_result(index: int, url: str, languages: Optional[List[str]], format: str) -> dict:
+        """批量接口和后台任务中的单个视频结果，出错时放在 error 字段中而不是抛出异常"""
+        result = {"index": index, "url": url, "video_id": YouTubeTools.get_youtube_video_id(url)}
+        try:
+            result["captions"] = await YouTubeTools.get_video_captions(url, languages, format)
+        except HTTPException as e:
+            result["error"] = {"status_code": e.status_code, "detail": e.detail}
         except Exception as e:
-            logger.error(f"直接获取字幕失败: {str(e)}")
-            import traceback
-            logger.error(f"详细错误信息: {traceback.format_exc()}")
-            return None
+            logger.error(f"批量请求中的视频失败: {url}, 错误: {str(e)}")
+            result["error"] = {"status_code": 500, "detail": str(e)}
+        return result
 
     @staticmethod
-    def get_video_timestamps(url: str, languages: Optional[List[str]] = None) -> List[str]:
-        """Generate timestamps for a YouTube video based on captions."""
-        if not url:
-            raise HTTPException(status_code=400, detail="No URL provided")
+    async def expand_job(spec: dict) -> List[str]:
+        """任务中的视频 URL 列表：直接给出的 URL 加上播放列表中的视频，去掉重复"""
+        urls = list(spec["urls"])
+        if spec.get("playlist"):
+            playlist = spec["playlist"]
+            if "list=" in playlist:
+                playlist = parse_qs(urlparse(playlist).query).get("list", [playlist])[0]
+            video_ids = await fetch_playlist_video_ids(playlist)
+            logger.info(f"播放列表 {playlist} 中有 {len(video_ids)} 个视频")
+            urls.extend(f"https://www.youtube.com/watch?v={video_id}" for video_id in video_ids)
+        return list(dict.fromkeys(urls))
+
+    @staticmethod
+    async def process_job_item(spec: dict, index: int, url: str) -> dict:
+        # 后台任务等待准入名额，不像交互请求那样在繁忙时被拒绝
+        with admission.background():
+            return await YouTubeTools.caption_result(
+                index, url, spec.get("languages"), spec.get("format") or "text"
+            )
+
+    @staticmethod
+    async def stream_captions_batch(items: List[Tuple[str, Optional[List[str]], str]],
+                                    concurrency: int) -> AsyncIterator[dict]:
+        """Fetch captions for many URLs with bounded concurrency, yielding each result as it finishes.
+
+        Errors are reported per item instead of failing the whole batch.
+        """
+        pending = iter(enumerate(items))
+        # 队列有上限，读取慢的客户端会让 worker 等待，而不是把整个批次的结果都缓存在内存中
+        results: asyncio.Queue = asyncio.Queue(maxsize=concurrency)
 
+        async def worker():
+            # 每个 worker 依次从迭代器中取任务，同时运行的请求数不超过 worker 数
+            for index, (url, languages, format) in pending:
+                await results.put(await YouTubeTools.caption_result(index, url, languages, format))
+
+        workers = [asyncio.ensure_future(worker()) for _ in range(min(concurrency, len(items)))]
         try:
-            video_id = YouTubeTools.get_youtube_video_id(url)
-            if not video_id:
-                raise HTTPException(status_code=400, detail="Invalid YouTube URL")
+            for _ in range(len(items)):
+                yield await results.get()
+        finally:
+            # 客户端断开时取消剩余的任务
+            for task in workers:
+                task.cancel()
+
+    @staticmethod
+    async def fetch_transcript_fallback(video_id: str, languages: Optional[List[str]] = None) -> Transcript:
+        """youtube_transcript_api 是同步库，放到线程池里执行"""
+        try:
+            # 它绕过了共享的 HTTP 客户端，先检查 YouTube 的熔断和限流状态
+            await ensure_available(f"{YOUTUBE_BASE_URL}/")
+            with stage("fallback"):
+                transcript = await run_fallback(YouTubeTools.get_transcript_fallback, video_id, languages)
+        except asyncio.TimeoutError:
+            record_strategy("fallback", False)
+            raise HTTPException(status_code=504, detail="Timed out waiting for youtube_transcript_api")
         except Exception:
-            raise HTTPException(status_code=400, detail="Error getting video ID from URL")
+            record_strategy("fallback", False)
+            raise
+        record_strategy("fallback", True)
+        return transcript
 
+    @staticmethod
+    def get_transcript_fallback(video_id: str, languages: Optional[List[str]] = None) -> Transcript:
+        """使用 youtube_transcript_api 获取字幕，这是同步调用，需要放到线程池中执行"""
         try:
-            # 记录更详细的信息
-            logger.info(f"尝试获取视频 ID: {video_id} 的时间戳")
-            
-            # 首先尝试直接从 YouTube 获取字幕
-            try:
-                logger.info("尝试直接从 YouTube 获取字幕用于时间戳")
-                captions_text = YouTubeTools.get_captions_direct_with_timestamps(video_id)
-                if captions_text:
-                    logger.info("成功直接从 YouTube 获取带时间戳的字幕")
-                    return captions_text
-                logger.warning("直接获取带时间戳的字幕失败，尝试使用 youtube_transcript_api")
-            except Exception as direct_e:
-                logger.warning(f"直接获取带时间戳的字幕失败: {str(direct_e)}，尝试使用 youtube_transcript_api")
-            
-            # 如果没有指定语言，尝试多种常见语言
-            if not languages:
-                languages = ["en", "zh", "zh-Hans", "zh-Hant", "zh-CN", "zh-TW", "ja", "ko", "es", "fr", "de", "ru", "pt", "it"]
-                logger.info(f"未指定语言，将尝试以下语言: {languages}")
-            
-            try:
-                # 尝试使用 youtube_transcript_api
-                logger.info(f"尝试使用指定语言获取字幕: {languages}")
-                captions = YouTubeTranscriptApi.get_transcript(video_id, languages=languages)
-                logger.info(f"成功获取字幕，语言: {languages}")
-            except Exception as e:
-                # 如果指定语言失败，尝试获取任何可用的字幕
-                logger.warning(f"使用指定语言获取字幕失败: {str(e)}，尝试获取任何可用的字幕")
-                try:
-                    transcript_list = YouTubeTranscriptApi.list_transcripts(video_id)
-                    logger.info(f"可用的字幕列表: {[tr.language_code for tr in transcript_list]}")
-                    
-                    # 获取第一个可用的字幕
-                    transcript = transcript_list.find_transcript(languages)
-                    if not transcript:
-                        # 如果找不到指定语言，获取自动生成的字幕
-                        transcript = next(transcript_list._manually_created_transcripts.values().__iter__(), None)
-                        if not transcript:
-                            # 如果没有手动创建的字幕，获取自动生成的字幕
-                            transcript = next(transcript_list._generated_transcripts.values().__iter__(), None)
-                    
-                    if transcript:
-                        logger.info(f"找到可用字幕，语言: {transcript.language_code}")
-                        captions = transcript.fetch()
-                    else:
-                        raise Exception("No available transcripts found")
-                except Exception as inner_e:
-                    logger.error(f"获取任何可用字幕失败: {str(inner_e)}")
-                    raise HTTPException(
-                        status_code=404,
-                        detail=f"This video does not have available subtitles. Error: {str(inner_e)}"
-                    )
-            
-            timestamps = []
-            for line in captions:
-                start = int(line["start"])
-                minutes, seconds = divmod(start, 60)
-                timestamps.append(f"{minutes}:{seconds:02d} - {line['text']}")
-            return timestamps
+            # 只列出一次字幕轨道，语言选择与直接抓取使用同一套规则
+            transcript_list = YouTubeTranscriptApi.list_transcripts(video_id)
+            index = [
+                {
+                    "language": transcript.language_code,
+                    "kind": "asr" if transcript.is_generated else "manual",
+                    "translatable": transcript.is_translatable,
+                    "transcript": transcript,
+                }
+                for transcript in transcript_list
+            ]
+            logger.debug(f"可用的字幕列表: {[track['language'] for track in index]}")
+
+            selection = select_track(index, languages)
+            if not selection:
+                raise NoSubtitles("This video does not have available subtitles. Error: No available transcripts found")
+            track, translate_to = selection
+            transcript = track["transcript"]
+            if translate_to:
+                logger.debug(f"将 {transcript.language_code} 字幕翻译为 {translate_to}")
+                transcript = transcript.translate(translate_to)
+            logger.debug(f"找到可用字幕，语言: {transcript.language_code}")
+            return Transcript.from_entries(transcript.fetch(), transcript.language_code)
+        except NoSubtitles:
+            raise
+        except (TranscriptsDisabled, NoTranscriptFound, NoTranscriptAvailable) as e:
+            logger.warning(f"youtube_transcript_api 报告没有字幕: {str(e)}")
+            raise NoSubtitles(f"This video does not have available subtitles. Error: {str(e)}")
         except Exception as e:
-            error_msg = str(e)
-            logger.error(f"生成时间戳时出错: {error_msg}")
-            if "Subtitles are disabled" in error_msg:
-                raise HTTPException(
-                    status_code=404,
-                    detail="This video does not have subtitles enabled. Please try another video or contact the video owner to enable subtitles."
-                )
-            raise HTTPException(status_code=500, detail=error_msg)
+            # 网络错误、被限流等，不能当作没有字幕
+            logger.error(f"获取任何可用字幕失败: {str(e)}")
+            raise HTTPException(status_code=502, detail=f"Error getting subtitles via youtube_transcript_api: {str(e)}")
 
     @staticmethod
-    def get_captions_direct_with_timestamps(video_id: str) -> Optional[List[str]]:
-        """直接从 YouTube 获取带时间戳的字幕，不使用第三方库"""
+    async def get_track_index(video_id: str) -> Optional[List[dict]]:
+        """Return the cached per-video caption track index, scanning the watch page on a miss.
+
+        None means the watch page could not be recognised, so it is not known
+        whether the video has captions.
+        """
+        cache_key = f"tracks:{video_id}"
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return cached["tracks"]
+        return await singleflight.do(("tracks", video_id), lambda: YouTubeTools.fetch_track_index(video_id, cache_key))
+
+    @staticmethod
+    async def fetch_track_index(video_id: str, cache_key: str) -> Optional[List[dict]]:
+        tracks = await fetch_caption_tracks(video_id)
+        if tracks is None:
+            # 没有识别出视频页面（同意页、错误页等），不能据此缓存"没有字幕"
+            logger.warning(f"视频页面中既没有 captionTracks 也没有 videoDetails: {video_id}")
+            return None
+        index = build_track_index(tracks)
+        # 字幕地址带有过期签名，轨道索引的缓存时间比字幕短
+        cache.set(cache_key, {"tracks": index}, TRACK_INDEX_TTL if index else NEGATIVE_CACHE_TTL)
+        return index
+
+    @staticmethod
+    async def fetch_transcript_direct(video_id: str, languages: Optional[List[str]] = None) -> Optional[Transcript]:
+        """直接从 YouTube 获取并解析字幕，不使用第三方库；只请求一次字幕内容"""
+        strategy = "method1"
         try:
-            # 获取视频页面
-            url = f"https://www.youtube.com/watch?v={video_id}"
-            headers = {
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
-                "Accept-Language": "en-US,en;q=0.9,zh-CN;q=0.8,zh;q=0.7"
-            }
-            logger.info(f"正在获取视频页面: {url}")
-            response = requests.get(url, headers=headers)
-            html_content = response.text
-            
-            # 尝试多种方式提取字幕 URL
             caption_url = None
-            
-            # 方法 1: 使用正则表达式查找 captionTracks
-            caption_url_match = re.search(r'"captionTracks":\[(.*?)\]', html_content)
-            if caption_url_match:
-                caption_data = caption_url_match.group(1)
-                logger.info(f"找到字幕轨道数据: {caption_data[:200]}...")
-                
-                base_url_match = re.search(r'"baseUrl":"(.*?)"', caption_data)
-                if base_url_match:
-                    caption_url = base_url_match.group(1).replace('\\u0026', '&')
-                    logger.info(f"方法 1 找到字幕 URL: {caption_url[:100]}...")
+            language = None
+
+            # 方法 1: 从轨道索引中按语言偏好选择字幕（索引来自流式扫描视频页面，并会被缓存）
+            index = await YouTubeTools.get_track_index(video_id)
+            # 只有识别出的视频页面中确实没有字幕轨道时才算确认没有字幕
+            no_tracks = index == []
+            selection = select_track(index or [], languages)
+            if selection:
+                track, translate_to = selection
+                caption_url = track_url(track, translate_to)
+                language = translate_to or track["language"]
+                logger.debug(f"方法 1 选择字幕轨道: {language} ({track['kind']}), URL: {caption_url[:100]}...")
             else:
                 logger.warning("方法 1 未找到字幕轨道信息")
-            
-            # 方法 2: 使用正则表达式查找 playerCaptionsTracklistRenderer
-            if not caption_url:
-                track_list_match = re.search(r'"playerCaptionsTracklistRenderer":(.*?),"videoDetails"', html_content)
-                if track_list_match:
-                    track_list_data = track_list_match.group(1)
-                    logger.info(f"找到字幕轨道列表数据: {track_list_data[:200]}...")
-                    
-                    base_url_match = re.search(r'"baseUrl":"(.*?)"', track_list_data)
-                    if base_url_match:
-                        caption_url = base_url_match.group(1).replace('\\u0026', '&')
-                        logger.info(f"方法 2 找到字幕 URL: {caption_url[:100]}...")
-                else:
-                    logger.warning("方法 2 未找到字幕轨道列表信息")
-            
+
             # 方法 3: 直接构造字幕 URL
             if not caption_url:
-                logger.info("尝试方法 3: 直接构造字幕 URL")
-                caption_url = f"https://www.youtube.com/api/timedtext?lang=en&v={video_id}"
-                logger.info(f"方法 3 构造的字幕 URL: {caption_url}")
-            
-            if not caption_url:
-                logger.warning("所有方法都未找到字幕 URL")
-                return None
+                logger.debug("尝试方法 3: 直接构造字幕 URL")
+                strategy = "method3"
+                language = languages[0] if languages else "en"
+                caption_url = f"{YOUTUBE_BASE_URL}/api/timedtext?lang={language}&v={video_id}"
+                logger.debug(f"方法 3 构造的字幕 URL: {caption_url}")
                 
             # 获取字幕内容
-            logger.info(f"正在获取字幕内容: {caption_url}")
-            caption_response = requests.get(caption_url)
-            caption_xml = caption_response.text
-            
-            # 记录字幕 XML 用于调试
-            debug_xml = caption_xml[:5000] + "..." if len(caption_xml) > 5000 else caption_xml
-            logger.info(f"获取到的字幕 XML: {debug_xml}")
-            
-            # 解析 XML 提取文本和时间
-            timestamps = []
-            pattern = re.compile(r'<text start="([\d\.]+)"[^>]*>(.*?)</text>')
-            matches = pattern.findall(caption_xml)
-            
-            if not matches:
-                logger.warning("未找到带时间戳的字幕文本，尝试其他格式")
-                # 尝试 JSON 格式
-                try:
-                    json_data = json.loads(caption_xml)
-                    if 'events' in json_data:
-                        for event in json_data['events']:
-                            if 'segs' in event and 'tStartMs' in event:
-                                text = ''.join([seg.get('utf8', '') for seg in event['segs']])
-                                start_seconds = event['tStartMs'] / 1000
-                                minutes, seconds = divmod(int(start_seconds), 60)
-                                timestamps.append(f"{minutes}:{seconds:02d} - {text}")
-                        logger.info(f"从 JSON 格式中提取到 {len(timestamps)} 个带时间戳的文本片段")
-                except Exception as json_e:
-                    logger.error(f"解析 JSON 格式失败: {str(json_e)}")
-            else:
-                logger.info(f"从 XML 格式中提取到 {len(matches)} 个带时间戳的文本片段")
-                for start, text in matches:
-                    # 清理 HTML 实体
-                    cleaned_text = text.replace('&amp;', '&').replace('&lt;', '<').replace('&gt;', '>').replace('&quot;', '"')
-                    
-                    # 转换时间为分:秒格式
-                    start_seconds = float(start)
-                    minutes, seconds = divmod(int(start_seconds), 60)
-                    
-                    timestamps.append(f"{minutes}:{seconds:02d} - {cleaned_text}")
-            
-            if not timestamps:
-                logger.warning("未能提取到带时间戳的字幕")
+            logger.debug(f"正在获取字幕内容: {caption_url}")
+            with stage("timedtext_fetch"):
+                caption_xml = await fetch_text(caption_url)
+
+            # 按采样率记录字幕 XML 用于调试，避免每个请求都截取和输出大段文本
+            if should_dump_payload():
+                logger.debug(f"获取到的字幕 XML: {caption_xml[:5000]}")
+
+            with stage("parse"):
+                transcript = parse_timedtext(caption_xml, language)
+            if not transcript:
+                logger.warning("未能提取到字幕")
+                record_strategy(strategy, False)
+                # 视频页面中没有字幕轨道，方法 3 也没有取到内容，确认没有字幕
+                if no_tracks:
+                    raise NoSubtitles()
                 return None
-                
-            logger.info(f"成功提取带时间戳的字幕，总条数: {len(timestamps)}")
-            return timestamps
+
+            logger.debug(f"成功提取字幕，总条数: {len(transcript)}")
+            record_strategy(strategy, True)
+            return transcript
+        except NoSubtitles:
+            raise
+        except UpstreamUnavailable:
+            # 熔断、限流或被 403 拦截时交给 get_transcript 返回过期缓存或 503，不能当作没有字幕
+            record_strategy(strategy, False)
+            raise
+        except httpx.HTTPStatusError as e:
+            # 其他非 2xx 的页面不是真实的回答，返回 502 且不缓存
+            record_strategy(strategy, False)
+            raise HTTPException(
+                status_code=502,
+                detail=f"YouTube returned HTTP {e.response.status_code} for {e.request.url.path}",
+            )
         except Exception as e:
-            logger.error(f"直接获取带时间戳的字幕失败: {str(e)}")
-            import traceback
-            logger.error(f"详细错误信息: {traceback.format_exc()}")
+            logger.error(f"直接获取字幕失败: {str(e)}", exc_info=logger.isEnabledFor(logging.DEBUG))
+            record_strategy(strategy, False)
+            return None
+
+    @staticmethod
+    async def get_captions_direct(video_id: str) -> Optional[str]:
+        """直接从 YouTube 获取字幕，不使用第三方库"""
+        transcript = await YouTubeTools.fetch_transcript_direct(video_id)
+        if not transcript:
             return None
+        return transcript.render_text()
+
+    @staticmethod
+    async def get_captions_direct_with_timestamps(video_id: str) -> Optional[List[str]]:
+        """直接从 YouTube 获取带时间戳的字幕，不使用第三方库"""
+        transcript = await YouTubeTools.fetch_transcript_direct(video_id)
+        if not transcript:
+            return None
+        return transcript.render_timestamps()
+
+# 注册顺序即没有统计数据时的优先级，prior_cost 是预估的单次成功耗时（秒）
+strategies.register("direct", YouTubeTools.fetch_transcript_direct, prior_cost=1.0)
+if FALLBACK_ENABLED:
+    strategies.register("fallback", YouTubeTools.fetch_transcript_fallback, prior_cost=3.0)
+
+jobs.register(YouTubeTools.expand_job, YouTubeTools.process_job_item)
 
 class YouTubeRequest(BaseModel):
     url: str
     languages: Optional[List[str]] = None
+    # 输出格式，不填时 /video-captions 返回纯文本，/video-timestamps 返回 "分:秒 - 文本" 列表
+    format: Optional[Literal["text", "timestamps", "srt", "vtt", "json"]] = None
+    # 为 True 时返回 languages 中所有语言的字幕，并按时间对齐
+    multi_language: bool = False
+    # 时间戳接口可把相邻字幕合并为固定窗口、句子或指定数量的章节
+    merge: Optional[Literal["window", "sentence", "chapters"]] = None
+    window: Optional[float] = None
+    chapters: Optional[int] = None
+
+class VideoDataBatchRequest(BaseModel):
+    # 视频 URL 或 11 位视频 ID
+    videos: List[str]
+    concurrency: Optional[int] = None
+
+class BatchCaptionsRequest(BaseModel):
+    items: List[YouTubeRequest]
+    concurrency: Optional[int] = None
+
+class JobRequest(BaseModel):
+    url: Optional[str] = None
+    urls: List[str] = []
+    # 播放列表 URL 或 ID
+    playlist: Optional[str] = None
+    languages: Optional[List[str]] = None
+    format: Optional[Literal["text", "timestamps", "srt", "vtt", "json"]] = None
+
+def render_body(result, format: str) -> Tuple[bytes, str]:
+    """SRT 和 WebVTT 作为文件内容直接返回，其他格式按 JSON 返回"""
+    if format in MEDIA_TYPES:
+        return result.encode("utf-8"), MEDIA_TYPES[format]
+    return json.dumps(result, ensure_ascii=False, separators=(",", ":")).encode("utf-8"), "application/json"
+
+async def transcript_response(request: Request, transcript: Transcript, format: str, render,
+                              variant: str = "") -> Response:
+    """ETag 由字幕内容、输出格式和 variant（例如合并参数）决定；未修改时返回 304，否则按 Accept-Encoding 压缩"""
+    etag = f'W/"{transcript.digest()}-{format}{variant}"'
+    return await encoded_responses.respond(request, etag, lambda: render_body(render(), format))
 
 @app.post("/video-data")
 async def get_video_data(request: YouTubeRequest):
     """Endpoint to get video metadata"""
-    logger.info(f"收到视频数据请求: {request.url}")
+    logger.debug(f"收到视频数据请求: {request.url}")
     try:
-        result = YouTubeTools.get_video_data(request.url)
-        logger.info(f"视频数据请求成功: {request.url}")
+        result = await YouTubeTools.get_video_data(request.url)
+        logger.debug(f"视频数据请求成功: {request.url}")
         return result
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"视频数据请求失败: {request.url}, 错误: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/video-data/batch")
+async def get_video_data_batch(request: VideoDataBatchRequest):
+    """Endpoint to get metadata for many videos in one call, served from the cache where possible"""
+    if not request.videos:
+        raise HTTPException(status_code=400, detail="No videos provided")
+    if len(request.videos) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"Too many videos, the limit is {BATCH_MAX_ITEMS}")
+
+    concurrency = max(1, min(request.concurrency or METADATA_BATCH_CONCURRENCY, BATCH_MAX_CONCURRENCY))
+    logger.debug(f"收到批量视频数据请求: {len(request.videos)} 个视频, 并发数: {concurrency}")
+    return {"items": await YouTubeTools.get_video_data_batch(request.videos, concurrency)}
+
 @app.post("/video-captions")
-async def get_video_captions(request: YouTubeRequest):
+async def get_video_captions(request: YouTubeRequest, http_request: Request):
     """Endpoint to get video captions"""
-    logger.info(f"收到字幕请求: {request.url}, 语言: {request.languages}")
+    logger.debug(f"收到字幕请求: {request.url}, 语言: {request.languages}")
     try:
-        result = YouTubeTools.get_video_captions(request.url, request.languages)
-        logger.info(f"字幕请求成功: {request.url}")
-        return result
+        transcript = await YouTubeTools.get_transcript(request.url, request.languages)
+        format = request.format or "text"
+        response = await transcript_response(
+            http_request, transcript, format, lambda: YouTubeTools.render_captions(transcript, format)
+        )
+        logger.debug(f"字幕请求成功: {request.url}")
+        return response
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"字幕请求失败: {request.url}, 错误: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/video-timestamps")
-async def get_video_timestamps(request: YouTubeRequest):
+async def get_video_timestamps(request: YouTubeRequest, http_request: Request):
     """Endpoint to get video timestamps"""
-    logger.info(f"收到时间戳请求: {request.url}, 语言: {request.languages}")
+    logger.debug(f"收到时间戳请求: {request.url}, 语言: {request.languages}")
     try:
-        result = YouTubeTools.get_video_timestamps(request.url, request.languages)
-        logger.info(f"时间戳请求成功: {request.url}")
-        return result
+        if request.multi_language:
+            result = await YouTubeTools.get_aligned_transcripts(request.url, request.languages)
+            logger.debug(f"多语言时间戳请求成功: {request.url}")
+            return result
+        if request.window is not None and request.window <= 0:
+            raise HTTPException(status_code=400, detail="window must be positive")
+        if request.chapters is not None and request.chapters < 1:
+            raise HTTPException(status_code=400, detail="chapters must be at least 1")
+        transcript = await YouTubeTools.get_transcript(request.url, request.languages)
+        format = request.format or "timestamps"
+        variant = f"-{request.merge}-{request.window or ''}-{request.chapters or ''}" if request.merge else ""
+        response = await transcript_response(
+            http_request,
+            transcript,
+            format,
+            lambda: YouTubeTools.render_timestamps(
+                transcript, format, request.merge, request.window, request.chapters
+            ),
+            variant,
+        )
+        logger.debug(f"时间戳请求成功: {request.url}")
+        return response
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"时间戳请求失败: {request.url}, 错误: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+# GET 版本便于浏览器缓存：响应带 ETag，再次请求时浏览器自动带上 If-None-Match，未修改时返回 304
+@app.get("/video-captions")
+async def get_video_captions_by_query(
+    http_request: Request,
+    url: str,
+    languages: Optional[List[str]] = Query(None),
+    format: Optional[Literal["text", "timestamps", "srt", "vtt", "json"]] = None,
+):
+    """Endpoint to get video captions with conditional GET support"""
+    return await get_video_captions(YouTubeRequest(url=url, languages=languages, format=format), http_request)
+
+@app.get("/video-timestamps")
+async def get_video_timestamps_by_query(
+    http_request: Request,
+    url: str,
+    languages: Optional[List[str]] = Query(None),
+    format: Optional[Literal["text", "timestamps", "srt", "vtt", "json"]] = None,
+    multi_language: bool = False,
+    merge: Optional[Literal["window", "sentence", "chapters"]] = None,
+    window: Optional[float] = None,
+    chapters: Optional[int] = None,
+):
+    """Endpoint to get video timestamps with conditional GET support"""
+    request = YouTubeRequest(
+        url=url, languages=languages, format=format, multi_language=multi_language,
+        merge=merge, window=window, chapters=chapters,
+    )
+    return await get_video_timestamps(request, http_request)
+
+@app.post("/video-bundle")
+async def get_video_bundle(request: YouTubeRequest):
+    """Endpoint to get metadata, captions and timestamps in one call"""
+    logger.debug(f"收到合并请求: {request.url}, 语言: {request.languages}")
+    try:
+        result = await YouTubeTools.get_video_bundle(request.url, request.languages)
+        logger.debug(f"合并请求成功: {request.url}")
+        return result
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"合并请求失败: {request.url}, 错误: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/video-captions/batch")
+async def get_video_captions_batch(request: BatchCaptionsRequest):
+    """Endpoint to get captions for many videos, streamed back as NDJSON"""
+    if not request.items:
+        raise HTTPException(status_code=400, detail="No items provided")
+    if len(request.items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"Too many items, the limit is {BATCH_MAX_ITEMS}")
+
+    concurrency = max(1, min(request.concurrency or BATCH_CONCURRENCY, BATCH_MAX_CONCURRENCY))
+    logger.debug(f"收到批量字幕请求: {len(request.items)} 个视频, 并发数: {concurrency}")
+
+    async def ndjson():
+        items = [(item.url, item.languages, item.format or "text") for item in request.items]
+        async for result in YouTubeTools.stream_captions_batch(items, concurrency):
+            yield json.dumps(result, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+@app.get("/search")
+async def search_transcripts(q: str, limit: int = 20, video_id: Optional[str] = None, language: Optional[str] = None):
+    """Endpoint to search indexed transcripts, returning ranked hits with video ID, start time and snippet"""
+    if not q.strip():
+        raise HTTPException(status_code=400, detail="q is required")
+    if limit < 1:
+        raise HTTPException(status_code=400, detail="limit must be positive")
+    try:
+        hits = await search_index.search(q, limit, video_id, language)
+    except sqlite3.OperationalError as e:
+        # 例如 trigram 分词时查询词少于 3 个字符
+        raise HTTPException(status_code=400, detail=f"Invalid search query: {str(e)}")
+    return {"query": q, "hits": hits}
+
+@app.post("/jobs", status_code=202)
+async def submit_job(request: JobRequest):
+    """Endpoint to submit a background job for a video, a list of videos or a playlist"""
+    urls = ([request.url] if request.url else []) + request.urls
+    if not urls and not request.playlist:
+        raise HTTPException(status_code=400, detail="url, urls or playlist is required")
+    if len(urls) > JOB_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"Too many videos, at most {JOB_MAX_ITEMS} are allowed")
+    for url in urls:
+        YouTubeTools.require_video_id(url)
+
+    spec = {"urls": urls, "playlist": request.playlist, "languages": request.languages, "format": request.format}
+    return await jobs.submit(spec)
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, results: bool = False):
+    """Endpoint to poll a job's progress, optionally with the finished results"""
+    job = await jobs.get(job_id, include_results=results)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.get("/jobs/{job_id}/stream")
+async def stream_job(job_id: str):
+    """Endpoint to stream a job's results as NDJSON until it finishes"""
+    if await jobs.get(job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def ndjson():
+        async for event in jobs.stream(job_id):
+            yield json.dumps(event, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    """按路由模板记录请求耗时，避免视频 ID 之类的路径参数产生过多标签"""
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        REQUEST_LATENCY.labels(
+            request.method, getattr(route, "path", "unmatched"), str(status)
+        ).observe(time.perf_counter() - started)
+
+@app.get("/metrics")
+async def get_metrics():
+    """Endpoint to expose Prometheus metrics"""
+    content, content_type = render_metrics()
+    return Response(content=content, headers={"Content-Type": content_type})
+
+@app.get("/cache-stats")
+async def get_cache_stats():
+    """Endpoint to get cache hit/miss, request coalescing, admission and retrieval strategy counters"""
+    return {
+        **cache.stats(),
+        "singleflight": singleflight.stats(),
+        "admission": admission.stats(),
+        "search": search_index.stats(),
+        "responses": encoded_responses.stats(),
+        "strategies": strategies.stats(),
+    }
+
+@app.get("/upstream-status")
+async def get_upstream_status():
+    """Endpoint to inspect per-host rate limit and circuit breaker state"""
+    return upstream_stats()
+
 @app.get("/test-captions/{video_id}")
 async def test_captions(video_id: str):
     """测试端点，用于直接测试字幕获取功能"""
-    logger.info(f"收到测试字幕请求: {video_id}")
+    logger.debug(f"收到测试字幕请求: {video_id}")
     try:
         # 尝试直接获取字幕
-        direct_result = YouTubeTools.get_captions_direct(video_id)
+        direct_result = await YouTubeTools.get_captions_direct(video_id)
         if direct_result:
-            logger.info("直接获取字幕成功")
+            logger.debug("直接获取字幕成功")
             return {"method": "direct", "captions": direct_result[:500] + "..." if len(direct_result) > 500 else direct_result}
         
         # 尝试使用 youtube_transcript_api
-        logger.info("直接获取失败，尝试使用 youtube_transcript_api")
+        logger.debug("直接获取失败，尝试使用 youtube_transcript_api")
         try:
-            captions = YouTubeTranscriptApi.get_transcript(video_id)
+            captions = await run_fallback(YouTubeTranscriptApi.get_transcript, video_id)
             api_result = " ".join(line["text"] for line in captions)
-            logger.info("使用 youtube_transcript_api 获取字幕成功")
+            logger.debug("使用 youtube_transcript_api 获取字幕成功")
             return {"method": "api", "captions": api_result[:500] + "..." if len(api_result) > 500 else api_result}
         except Exception as api_e:
             logger.error(f"使用 youtube_transcript_api 获取字幕失败: {str(api_e)}")
@@ -527,25 +995,25 @@ async def test_captions(video_id: str):
 @app.get("/test-timestamps/{video_id}")
 async def test_timestamps(video_id: str):
     """测试端点，用于直接测试时间戳获取功能"""
-    logger.info(f"收到测试时间戳请求: {video_id}")
+    logger.debug(f"收到测试时间戳请求: {video_id}")
     try:
         # 尝试直接获取时间戳
-        direct_result = YouTubeTools.get_captions_direct_with_timestamps(video_id)
+        direct_result = await YouTubeTools.get_captions_direct_with_timestamps(video_id)
         if direct_result:
-            logger.info("直接获取时间戳成功")
+            logger.debug("直接获取时间戳成功")
             return {"method": "direct", "timestamps_count": len(direct_result), "timestamps": direct_result[:10]}
         
         # 尝试使用 youtube_transcript_api
-        logger.info("直接获取失败，尝试使用 youtube_transcript_api")
+        logger.debug("直接获取失败，尝试使用 youtube_transcript_api")
         try:
-            captions = YouTubeTranscriptApi.get_transcript(video_id)
+            captions = await run_fallback(YouTubeTranscriptApi.get_transcript, video_id)
             timestamps = []
             for line in captions:
                 start = int(line["start"])
                 minutes, seconds = divmod(start, 60)
                 timestamps.append(f"{minutes}:{seconds:02d} - {line['text']}")
             
-            logger.info("使用 youtube_transcript_api 获取时间戳成功")
+            logger.debug("使用 youtube_transcript_api 获取时间戳成功")
             return {"method": "api", "timestamps_count": len(timestamps), "timestamps": timestamps[:10]}
         except Exception as api_e:
             logger.error(f"使用 youtube_transcript_api 获取时间戳失败: {str(api_e)}")
@@ -0,0 +1,100 @@
+"""Prometheus 指标：各阶段耗时、字幕获取策略的结果，以及按采样率输出调试内容"""
+import os
+import random
+import time
+from contextlib import contextmanager
+from typing import Iterator, Tuple
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, generate_latest
+from prometheus_client import multiprocess
+
+# 调试时按比例记录上游返回的原始内容，默认关闭
+DEBUG_PAYLOAD_SAMPLE_RATE = float(os.getenv("DEBUG_PAYLOAD_SAMPLE_RATE", 0))
+
+# 阶段: url_parse, watch_page_fetch, track_extraction, timedtext_fetch, parse, fallback, render
+STAGE_LATENCY = Histogram(
+    "youtube_api_stage_seconds",
+    "Time spent in each stage of serving a request",
+    ["stage"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+STAGE_ERRORS = Counter(
+    "youtube_api_stage_errors_total",
+    "Stages that raised an exception",
+    ["stage"],
+)
+# 策略: method1（轨道索引）, method3（构造 URL）, fallback（youtube_transcript_api）
+STRATEGY_RESULTS = Counter(
+    "youtube_api_caption_strategy_total",
+    "Caption retrieval attempts by strategy and outcome",
+    ["strategy", "outcome"],
+)
+# 对冲请求: started（发起）, won（对冲的策略先返回结果）
+HEDGED_REQUESTS = Counter(
+    "youtube_api_hedged_requests_total",
+    "Hedged caption retrieval attempts",
+    ["outcome"],
+)
+# 出站请求结果: ok, error（网络错误/超时）, rejected（熔断或限流）, 以及可重试的状态码
+UPSTREAM_REQUESTS = Counter(
+    "youtube_api_upstream_requests_total",
+    "Outbound requests by host and outcome",
+    ["host", "outcome"],
+)
+# 准入控制：进行中和排队中的冷请求数，以及被拒绝的次数（queue_full, queue_timeout）
+# 多个 worker 时取所有存活进程之和
+ADMISSION_INFLIGHT = Gauge(
+    "youtube_api_admission_inflight",
+    "Cache-miss requests holding an upstream slot",
+    multiprocess_mode="livesum",
+)
+ADMISSION_QUEUE = Gauge(
+    "youtube_api_admission_queue_depth",
+    "Cache-miss requests waiting for an upstream slot",
+    multiprocess_mode="livesum",
+)
+ADMISSION_SHED = Counter(
+    "youtube_api_admission_shed_total",
+    "Requests rejected with 503 by admission control",
+    ["reason"],
+)
+REQUEST_LATENCY = Histogram(
+    "youtube_api_request_seconds",
+    "End-to-end request latency by route",
+    ["method", "route", "status"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Time a block as one stage; exceptions are counted and re-raised."""
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        STAGE_ERRORS.labels(name).inc()
+        raise
+    finally:
+        STAGE_LATENCY.labels(name).observe(time.perf_counter() - started)
+
+
+def record_strategy(strategy: str, success: bool) -> None:
+    STRATEGY_RESULTS.labels(strategy, "success" if success else "failure").inc()
+
+
+def should_dump_payload() -> bool:
+    """是否记录本次请求的原始内容（HTML/XML），按 DEBUG_PAYLOAD_SAMPLE_RATE 采样"""
+    return DEBUG_PAYLOAD_SAMPLE_RATE > 0 and random.random() < DEBUG_PAYLOAD_SAMPLE_RATE
+
+
+def render_metrics() -> Tuple[bytes, str]:
+    """Prometheus 文本格式的指标内容和对应的 Content-Type
+
+    在 gunicorn 下运行时（设置了 PROMETHEUS_MULTIPROC_DIR）汇总所有 worker 的指标。
+    """
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
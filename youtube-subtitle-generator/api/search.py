@@ -0,0 +1,198 @@
+"""字幕全文检索：SQLite FTS5 索引每一条字幕，查询返回视频 ID、开始时间和摘要
+
+索引在后台批量写入（线程池中执行），请求处理只把字幕放进队列，不等待写入。
+"""
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import List, Optional, Tuple
+
+from cache import LazySQLite, connect_sqlite
+from fetcher import run_blocking
+from transcript import Transcript
+
+logger = logging.getLogger(__name__)
+
+SEARCH_DB_PATH = os.getenv("SEARCH_DB_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "search.db"))
+# 默认按 Unicode 单词切分；中日韩文字没有空格分词，可以设置为 trigram 支持子串检索（查询至少 3 个字符）
+SEARCH_TOKENIZER = os.getenv("SEARCH_TOKENIZER", "unicode61 remove_diacritics 2")
+SEARCH_QUEUE_SIZE = int(os.getenv("SEARCH_QUEUE_SIZE", 1000))
+SEARCH_BATCH_SIZE = 50
+SEARCH_MAX_LIMIT = 100
+
+
+def fts_query(text: str) -> str:
+    """把用户输入转换为 FTS5 查询：每个词作为带引号的短语，全部都要出现，避免特殊字符导致语法错误"""
+    terms = [term.replace('"', '""') for term in text.split()]
+    return " ".join(f'"{term}"' for term in terms if term)
+
+
+class SearchStore(LazySQLite):
+    """FTS5 table with one row per cue, plus the list of indexed (video, language) pairs.
+
+    Writes and queries use separate connections; with WAL, a query does not
+    wait for a batch being written.
+    """
+
+    def __init__(self, path: str = SEARCH_DB_PATH, tokenizer: str = SEARCH_TOKENIZER):
+        super().__init__(path, [
+            "CREATE TABLE IF NOT EXISTS indexed_videos ("
+            "video_id TEXT NOT NULL, language TEXT NOT NULL, cues INTEGER NOT NULL, indexed_at REAL NOT NULL, "
+            "PRIMARY KEY (video_id, language))",
+            "CREATE VIRTUAL TABLE IF NOT EXISTS cues USING fts5("
+            f"text, video_id UNINDEXED, language UNINDEXED, start UNINDEXED, tokenize='{tokenizer}')",
+        ], timeout=10)
+        self.tokenizer = tokenizer
+        self._reader: Optional[sqlite3.Connection] = None
+        self._read_lock = threading.Lock()
+
+    def _connect_reader(self) -> sqlite3.Connection:
+        if self._reader is None:
+            with self._lock:
+                # 确保表已经创建
+                self._connect()
+            self._reader = connect_sqlite(self.path, timeout=self.timeout)
+        return self._reader
+
+    def add(self, batch: List[Tuple[str, Transcript]]) -> int:
+        """写入一批字幕，已经索引过的视频和语言会被跳过，返回新索引的数量"""
+        added = 0
+        with self._lock:
+            conn = self._connect()
+            now = time.time()
+            for video_id, transcript in batch:
+                language = transcript.language or ""
+                cursor = conn.execute(
+                    "INSERT OR IGNORE INTO indexed_videos (video_id, language, cues, indexed_at) VALUES (?, ?, ?, ?)",
+                    (video_id, language, len(transcript), now),
+                )
+                # 其他进程可能已经索引过
+                if cursor.rowcount == 0:
+                    continue
+                conn.executemany(
+                    "INSERT INTO cues (text, video_id, language, start) VALUES (?, ?, ?, ?)",
+                    ((text, video_id, language, start) for start, _, text in transcript.cues()),
+                )
+                added += 1
+            conn.commit()
+        return added
+
+    def search(self, query: str, limit: int = 20, video_id: Optional[str] = None,
+               language: Optional[str] = None) -> List[dict]:
+        match = fts_query(query)
+        if not match:
+            return []
+        sql = (
+            "SELECT video_id, language, start, snippet(cues, 0, '[', ']', '…', 16), bm25(cues) "
+            "FROM cues WHERE cues MATCH ?"
+        )
+        params: list = [match]
+        if video_id:
+            sql += " AND video_id = ?"
+            params.append(video_id)
+        if language:
+            sql += " AND language = ?"
+            params.append(language)
+        sql += " ORDER BY rank LIMIT ?"
+        params.append(limit)
+        with self._read_lock:
+            rows = self._connect_reader().execute(sql, params).fetchall()
+        hits = []
+        for video_id, language, start, snippet, score in rows:
+            minutes, seconds = divmod(int(start), 60)
+            hits.append({
+                "video_id": video_id,
+                "language": language,
+                "start": start,
+                "timestamp": f"{minutes}:{seconds:02d}",
+                "snippet": snippet,
+                # bm25 越小越相关，取反后越大越相关
+                "score": -score,
+            })
+        return hits
+
+    def close(self) -> None:
+        with self._lock, self._read_lock:
+            for conn in (self._conn, self._reader):
+                if conn is not None:
+                    conn.close()
+            self._conn = None
+            self._reader = None
+
+
+class SearchIndex:
+    """Queue transcripts for indexing and write them in batches off the event loop.
+
+    ``submit`` never blocks: transcripts already seen by this process are
+    skipped, and when the queue is full the transcript is dropped (it will be
+    submitted again the next time it is served).
+    """
+
+    def __init__(self, store: SearchStore, queue_size: int = SEARCH_QUEUE_SIZE):
+        self.store = store
+        self.queue_size = queue_size
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._seen = set()
+        self.indexed = 0
+        self.dropped = 0
+
+    def start(self) -> None:
+        self._queue = asyncio.Queue(self.queue_size)
+        self._task = asyncio.ensure_future(self._writer())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            # 先写完队列中剩余的字幕
+            if not self._task.done():
+                await self._queue.join()
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        self.store.close()
+
+    def submit(self, video_id: str, transcript: Transcript) -> None:
+        key = (video_id, transcript.language or "")
+        if self._queue is None or key in self._seen or not len(transcript):
+            return
+        try:
+            self._queue.put_nowait((video_id, transcript))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            return
+        if len(self._seen) > 100000:
+            self._seen.clear()
+        self._seen.add(key)
+
+    async def _writer(self) -> None:
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < SEARCH_BATCH_SIZE and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            try:
+                self.indexed += await run_blocking(self.store.add, batch)
+            except Exception as e:
+                # 任何错误都不能让写入任务退出，否则之后的字幕无人处理，stop() 也会一直等待队列
+                logger.warning(f"写入检索索引失败: {str(e)}")
+                for video_id, transcript in batch:
+                    self._seen.discard((video_id, transcript.language or ""))
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def search(self, query: str, limit: int = 20, video_id: Optional[str] = None,
+                     language: Optional[str] = None) -> List[dict]:
+        return await run_blocking(self.store.search, query, min(limit, SEARCH_MAX_LIMIT), video_id, language)
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "indexed": self.indexed,
+            "dropped": self.dropped,
+        }
+
+
+search_index = SearchIndex(SearchStore())
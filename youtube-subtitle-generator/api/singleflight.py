@@ -0,0 +1,46 @@
+"""请求合并：同一个 key 的并发调用只执行一次上游请求，结果（或异常）共享给所有调用方"""
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """Deduplicate concurrent coroutine calls by key.
+
+    The first caller starts the work as a separate task; later callers with the
+    same key await that task. Each caller awaits through ``asyncio.shield``, so a
+    cancelled caller (e.g. a client disconnect) never cancels the shared fetch
+    for everyone else.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self.started = 0
+        self.joined = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._forget(key, t))
+            self.started += 1
+        else:
+            self.joined += 1
+            logger.debug(f"合并并发请求: {key}")
+        return await asyncio.shield(task)
+
+    def _forget(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # 所有调用方都已取消时也要取出异常，避免 "exception was never retrieved" 警告
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> dict:
+        return {"inflight": len(self._inflight), "started": self.started, "joined": self.joined}
+
+
+singleflight = SingleFlight()
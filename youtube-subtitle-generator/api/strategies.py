@@ -0,0 +1,223 @@
+"""字幕获取策略：根据滚动统计动态排序，首选策略超过 p95 耗时后可以对冲发起下一个策略"""
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+
+from fetcher import UpstreamUnavailable
+from metrics import HEDGED_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+# 每个策略保留最近多少次尝试的结果
+STRATEGY_WINDOW = int(os.getenv("STRATEGY_WINDOW", 100))
+STRATEGY_HEDGE = os.getenv("STRATEGY_HEDGE", "true").lower() in ("1", "true", "yes")
+# 成功样本不足时使用默认的对冲等待时间
+HEDGE_DEFAULT_DELAY = float(os.getenv("HEDGE_DEFAULT_DELAY", 2.0))
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", 0.2))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", 20))
+# 对冲请求最多占请求数的比例，限制额外的上游调用量
+HEDGE_MAX_RATIO = float(os.getenv("HEDGE_MAX_RATIO", 0.1))
+HEDGE_BURST = 10.0
+
+Fetch = Callable[[str, Optional[List[str]]], Awaitable[Optional[Any]]]
+
+
+class NoSubtitles(HTTPException):
+    """404 for a video that has no captions: its track list was empty or captions are disabled.
+
+    Only this error is cached negatively, other failures may be transient.
+    """
+
+    def __init__(self, detail: str = "This video does not have available subtitles."):
+        super().__init__(status_code=404, detail=detail)
+
+
+class StrategyProvider:
+    """One way of retrieving a transcript plus rolling stats of its recent attempts.
+
+    ``fetch`` returns the result, or None / raises when the strategy failed.
+    ``prior_cost`` is the assumed seconds per success before any samples exist.
+    """
+
+    def __init__(self, name: str, fetch: Fetch, prior_cost: float, window: int = STRATEGY_WINDOW):
+        self.name = name
+        self.fetch = fetch
+        self.prior_cost = prior_cost
+        # (是否成功, 耗时)，失败的耗时也计入，降级时它正是请求要付出的代价
+        self._attempts: Deque[tuple] = deque(maxlen=window)
+
+    def record(self, success: bool, latency: float) -> None:
+        self._attempts.append((success, latency))
+
+    def success_rate(self) -> Optional[float]:
+        if not self._attempts:
+            return None
+        return sum(1 for success, _ in self._attempts if success) / len(self._attempts)
+
+    def expected_cost(self) -> float:
+        """平均每次成功需要花费的秒数，先验算作一次成功的尝试"""
+        total = self.prior_cost + sum(latency for _, latency in self._attempts)
+        successes = 1 + sum(1 for success, _ in self._attempts if success)
+        return total / successes
+
+    def latency_quantile(self, q: float) -> Optional[float]:
+        """成功尝试耗时的分位数，样本不足时返回 None"""
+        latencies = sorted(latency for success, latency in self._attempts if success)
+        if len(latencies) < HEDGE_MIN_SAMPLES:
+            return None
+        return latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+
+    def hedge_delay(self) -> float:
+        p95 = self.latency_quantile(0.95)
+        return max(HEDGE_MIN_DELAY, p95 if p95 is not None else HEDGE_DEFAULT_DELAY)
+
+    def stats(self) -> dict:
+        return {
+            "name": self.name,
+            "attempts": len(self._attempts),
+            "success_rate": self.success_rate(),
+            "expected_cost": self.expected_cost(),
+            "p50": self.latency_quantile(0.5),
+            "p95": self.latency_quantile(0.95),
+        }
+
+
+class StrategyRunner:
+    """Run providers cheapest-first by expected cost per success.
+
+    The next provider starts when the current one fails, or as a hedge once the
+    current one has run past its p95 latency. Hedges are limited to one per
+    request and to ``HEDGE_MAX_RATIO`` of requests overall; the first
+    successful result wins and the other attempt is cancelled.
+    """
+
+    def __init__(self, hedge: bool = STRATEGY_HEDGE, hedge_max_ratio: float = HEDGE_MAX_RATIO):
+        self.providers: List[StrategyProvider] = []
+        self.hedge = hedge
+        self.hedge_max_ratio = hedge_max_ratio
+        self._hedge_tokens = HEDGE_BURST
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def register(self, name: str, fetch: Fetch, prior_cost: float) -> StrategyProvider:
+        provider = StrategyProvider(name, fetch, prior_cost)
+        self.providers.append(provider)
+        return provider
+
+    def ordered(self) -> List[StrategyProvider]:
+        # sorted 是稳定排序，代价相同时保持注册顺序
+        return sorted(self.providers, key=lambda provider: provider.expected_cost())
+
+    def _take_hedge_token(self) -> bool:
+        if self._hedge_tokens >= 1:
+            self._hedge_tokens -= 1
+            return True
+        return False
+
+    async def _attempt(self, provider: StrategyProvider, video_id: str, languages: Optional[List[str]]) -> Any:
+        started = time.perf_counter()
+        try:
+            result = await provider.fetch(video_id, languages)
+        except Exception:
+            provider.record(False, time.perf_counter() - started)
+            raise
+        provider.record(bool(result), time.perf_counter() - started)
+        return result
+
+    async def run(self, video_id: str, languages: Optional[List[str]] = None) -> Any:
+        """Return the first successful result.
+
+        If all fail, an ``UpstreamUnavailable`` from any provider is raised first
+        (so callers can serve stale data or 503), then the last error, and a plain
+        404 only when every provider just found nothing.
+        """
+        self.requests += 1
+        self._hedge_tokens = min(HEDGE_BURST, self._hedge_tokens + self.hedge_max_ratio)
+
+        remaining = self.ordered()
+        pending: Dict[asyncio.Task, Tuple[StrategyProvider, float]] = {}
+        last_error: Optional[Exception] = None
+        upstream_error: Optional[UpstreamUnavailable] = None
+        hedged = False
+
+        def start_next() -> Optional[StrategyProvider]:
+            if not remaining:
+                return None
+            provider = remaining.pop(0)
+            logger.debug(f"尝试字幕获取策略: {provider.name}")
+            task = asyncio.ensure_future(self._attempt(provider, video_id, languages))
+            pending[task] = (provider, time.perf_counter())
+            return provider
+
+        try:
+            current = start_next()
+            while pending:
+                timeout = None
+                if self.hedge and not hedged and remaining:
+                    timeout = current.hedge_delay()
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # 首选策略超过了 p95 耗时，在预算允许时对冲发起下一个策略
+                    hedged = True
+                    if self._take_hedge_token():
+                        self.hedges += 1
+                        HEDGED_REQUESTS.labels("started").inc()
+                        provider = start_next()
+                        logger.info(f"{current.name} 超过 {timeout:.2f}s，对冲发起 {provider.name}")
+                    continue
+
+                for task in done:
+                    provider, _ = pending.pop(task)
+                    try:
+                        result = task.result()
+                    except Exception as e:
+                        logger.warning(f"字幕获取策略 {provider.name} 失败: {str(e)}")
+                        last_error = e
+                        if isinstance(e, UpstreamUnavailable):
+                            upstream_error = e
+                        result = None
+                    if result:
+                        if hedged and provider is not current:
+                            self.hedge_wins += 1
+                            HEDGED_REQUESTS.labels("won").inc()
+                        # 输掉竞争的尝试至少已经这么慢了，按失败计入，让排序尽快调整
+                        now = time.perf_counter()
+                        for other, (loser, started) in pending.items():
+                            if not other.done():
+                                loser.record(False, now - started)
+                        return result
+
+                if not pending:
+                    current = start_next()
+        finally:
+            for task in pending:
+                if task.done():
+                    # 同时完成但未被采用的结果，取出异常避免 "exception was never retrieved" 警告
+                    if not task.cancelled():
+                        task.exception()
+                else:
+                    task.cancel()
+
+        if upstream_error is not None:
+            raise upstream_error
+        if last_error is not None:
+            raise last_error
+        raise HTTPException(status_code=404, detail="This video does not have available subtitles.")
+
+    def stats(self) -> dict:
+        return {
+            "order": [provider.name for provider in self.ordered()],
+            "providers": [provider.stats() for provider in self.providers],
+            "requests": self.requests,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+        }
+
+
+strategies = StrategyRunner()
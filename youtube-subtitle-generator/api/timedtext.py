@@ -0,0 +1,140 @@
+"""timedtext 字幕解析：先判断格式（srv1、srv3、json3），再单遍解析出字幕
+
+XML 格式用一次 findall 取出所有字幕，文本用不会出现在 XML 中的 \\x00 连接后整段解码，
+避免逐条调用 html.unescape 和多次 replace。
+"""
+import html
+import json
+import logging
+import re
+from array import array
+from itertools import compress
+from typing import List, Optional
+
+from transcript import Transcript
+
+logger = logging.getLogger(__name__)
+
+# srv1（默认格式）：<text start="1.2" dur="3.4">...</text>，时间单位为秒；
+# 文本中的 < 都已转义，用 [^<]* 代替非贪婪匹配，不需要逐字符回溯
+_SRV1_CUE = re.compile(r'<text start="([\d.]+)"(?: dur="([\d.]+)")?[^>]*>([^<]*)</text>')
+# srv3：<p t="1200" d="3400">...</p>，时间单位为毫秒，文本可能分成多个 <s> 片段
+_SRV3_CUE = re.compile(r'<p t="(\d+)"(?: d="(\d+)")?[^>]*>(.*?)</p>', re.DOTALL)
+_TAG = re.compile(r"<[^>]*>")
+_SEPARATOR = "\x00"
+
+# 常见实体直接替换；替换结果不含 &，不会和剩下的实体组成新的实体
+_COMMON_ENTITIES = (("&#39;", "'"), ("&quot;", '"'), ("&lt;", "<"), ("&gt;", ">"), ("&#34;", '"'))
+
+
+def detect_format(body: str) -> Optional[str]:
+    """Return ``srv1``, ``srv3``, ``json3`` or None from the start of the body."""
+    head = body[:512].lstrip()
+    if head.startswith("{"):
+        return "json3"
+    if head.startswith("<"):
+        if '<timedtext format="3"' in head:
+            return "srv3"
+        if "<transcript" in head:
+            return "srv1"
+    return None
+
+
+def decode_entities(text: str) -> str:
+    """Decode one level of HTML entities, with the common ones handled by plain replaces."""
+    if "&" not in text:
+        return text
+    # srv1 的 XML 层通常只有 &amp;
+    if text.count("&") == text.count("&amp;"):
+        return text.replace("&amp;", "&")
+    for entity, char in _COMMON_ENTITIES:
+        if entity in text:
+            text = text.replace(entity, char)
+    if "&" in text:
+        # 只剩 &amp; 时最后替换即可；其他实体（包括所有数字引用）交给 html.unescape
+        if text.count("&") == text.count("&amp;"):
+            text = text.replace("&amp;", "&")
+        else:
+            text = html.unescape(text)
+    return text
+
+
+def _seconds(values: tuple, scale: float = 1.0) -> array:
+    """时间字符串转为秒；缺少时长的字幕（空字符串）记为 0"""
+    if "" in values:
+        values = [value or "0" for value in values]
+    if scale == 1.0:
+        return array("d", map(float, values))
+    return array("d", [value / scale for value in map(int, values)])
+
+
+def _from_matches(matches: List[tuple], text: str, scale: float, drop_empty: bool,
+                  language: Optional[str]) -> Transcript:
+    starts, durations, _ = zip(*matches)
+    texts = text.split(_SEPARATOR)
+    starts, durations = _seconds(starts, scale), _seconds(durations, scale)
+    if drop_empty and not all(map(str.strip, texts)):
+        keep = list(map(bool, map(str.strip, texts)))
+        starts = array("d", compress(starts, keep))
+        durations = array("d", compress(durations, keep))
+        texts = list(compress(texts, keep))
+    return Transcript.from_columns(starts, durations, texts, language)
+
+
+def _parse_srv1(body: str, language: Optional[str]) -> Transcript:
+    matches = _SRV1_CUE.findall(body)
+    if not matches:
+        return Transcript.from_cues((), language)
+    text = _SEPARATOR.join([match[2] for match in matches])
+    # srv1 的文本先做了 HTML 转义又做了 XML 转义（撇号是 &amp;#39;），需要解码两次
+    text = decode_entities(decode_entities(text))
+    return _from_matches(matches, text, 1.0, False, language)
+
+
+def _parse_srv3(body: str, language: Optional[str]) -> Transcript:
+    matches = _SRV3_CUE.findall(body)
+    if not matches:
+        return Transcript.from_cues((), language)
+    text = _SEPARATOR.join([match[2] for match in matches])
+    # 去掉 <s> 等片段标签，只保留文本
+    if "<" in text:
+        text = _TAG.sub("", text)
+    text = decode_entities(text)
+    # 自动字幕中有只用来换行的空段落
+    return _from_matches(matches, text, 1000.0, True, language)
+
+
+def _parse_json3(body: str, language: Optional[str]) -> Transcript:
+    starts = array("d")
+    durations = array("d")
+    texts = []
+    for event in json.loads(body).get("events", ()):
+        segs = event.get("segs")
+        if not segs or "tStartMs" not in event:
+            continue
+        text = "".join([seg.get("utf8", "") for seg in segs])
+        if text.strip():
+            starts.append(event["tStartMs"] / 1000)
+            durations.append(event.get("dDurationMs", 0) / 1000)
+            texts.append(text)
+    return Transcript.from_columns(starts, durations, texts, language)
+
+
+_PARSERS = {"srv1": _parse_srv1, "srv3": _parse_srv3, "json3": _parse_json3}
+
+
+def parse_timedtext(body: str, language: Optional[str] = None) -> Transcript:
+    """Parse a timedtext response into a Transcript in one pass.
+
+    The format is detected up front instead of trying one parser after
+    another. Entities are fully decoded, and the cue columns go straight
+    into the transcript's arrays. An unrecognized body gives an empty
+    transcript.
+    """
+    format = detect_format(body)
+    if format is None:
+        logger.warning(f"无法识别的字幕格式: {body[:100]!r}")
+        return Transcript.from_cues((), language)
+    transcript = _PARSERS[format](body, language)
+    logger.debug(f"从 {format} 格式中提取到 {len(transcript)} 条字幕")
+    return transcript
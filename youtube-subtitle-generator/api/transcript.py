@@ -0,0 +1,238 @@
+"""紧凑的字幕模型：开始时间和时长存放在 array 中，所有文本存放在同一个字符串缓冲区里"""
+import hashlib
+from array import array
+from itertools import accumulate
+from typing import Iterable, Iterator, List, Tuple, Optional
+
+# 支持的输出格式
+FORMATS = ("text", "timestamps", "srt", "vtt", "json")
+
+# 合并字幕的方式：固定时间窗口、句子、指定数量的章节
+MERGE_MODES = ("window", "sentence", "chapters")
+# 句末标点（忽略末尾的引号和括号）
+_SENTENCE_END = (".", "?", "!", "。", "？", "！", "…")
+_CLOSING = "\"'”’)）」』"
+
+MEDIA_TYPES = {
+    "srt": "application/x-subrip; charset=utf-8",
+    "vtt": "text/vtt",
+}
+
+
+def _clock(seconds: float, separator: str) -> str:
+    """秒数转换为 HH:MM:SS,mmm（SRT）或 HH:MM:SS.mmm（WebVTT）"""
+    millis = int(round(seconds * 1000))
+    hours, millis = divmod(millis, 3600 * 1000)
+    minutes, millis = divmod(millis, 60 * 1000)
+    secs, millis = divmod(millis, 1000)
+    return f"{hours:02d}:{minutes:02d}:{secs:02d}{separator}{millis:03d}"
+
+
+class Transcript:
+    """A parsed caption track: start, duration and text for every cue.
+
+    Texts are joined with single spaces into one buffer, so the plain-text
+    rendering is the buffer itself and a cue's text is a slice of it. Other
+    formats are rendered on demand from the same storage.
+    """
+
+    __slots__ = ("starts", "durations", "text", "offsets", "language", "_digest")
+
+    def __init__(self, starts: array, durations: array, text: str, offsets: array,
+                 language: Optional[str] = None):
+        self.starts = starts
+        self.durations = durations
+        self.text = text
+        # offsets[i] 是第 i 条字幕在 text 中的起始位置，最后一项是 len(text) + 1
+        self.offsets = offsets
+        self.language = language
+        self._digest: Optional[str] = None
+
+    @classmethod
+    def from_cues(cls, cues: Iterable[Tuple[float, float, str]], language: Optional[str] = None) -> "Transcript":
+        """Build from (start, duration, text) tuples in a single pass."""
+        starts = array("d")
+        durations = array("d")
+        offsets = array("I")
+        texts = []
+        position = 0
+        for start, duration, text in cues:
+            starts.append(start)
+            durations.append(duration)
+            offsets.append(position)
+            texts.append(text)
+            position += len(text) + 1
+        offsets.append(position)
+        return cls(starts, durations, " ".join(texts), offsets, language)
+
+    @classmethod
+    def from_columns(cls, starts: array, durations: array, texts: List[str],
+                     language: Optional[str] = None) -> "Transcript":
+        """Build from parallel columns; the text buffer is joined once and offsets come from the lengths."""
+        offsets = array("I", accumulate((len(text) + 1 for text in texts), initial=0))
+        return cls(starts, durations, " ".join(texts), offsets, language)
+
+    @classmethod
+    def from_entries(cls, entries: Iterable[dict], language: Optional[str] = None) -> "Transcript":
+        """从 youtube_transcript_api 返回的字典列表构造"""
+        return cls.from_cues(
+            ((entry["start"], entry.get("duration", 0.0), entry["text"]) for entry in entries),
+            language,
+        )
+
+    @classmethod
+    def from_cache(cls, data: dict) -> "Transcript":
+        return cls(array("d", data["starts"]), array("d", data["durations"]), data["text"],
+                   array("I", data["offsets"]), data.get("language"))
+
+    def to_cache(self) -> dict:
+        return {
+            "starts": self.starts.tolist(),
+            "durations": self.durations.tolist(),
+            "text": self.text,
+            "offsets": self.offsets.tolist(),
+            "language": self.language,
+        }
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def digest(self) -> str:
+        """Content hash of the cues and language, used for ETags."""
+        if self._digest is None:
+            h = hashlib.blake2b(digest_size=16)
+            h.update(self.starts.tobytes())
+            h.update(self.durations.tobytes())
+            h.update(self.offsets.tobytes())
+            h.update(self.text.encode("utf-8"))
+            h.update((self.language or "").encode("utf-8"))
+            self._digest = h.hexdigest()
+        return self._digest
+
+    def text_at(self, index: int) -> str:
+        return self.text[self.offsets[index]:self.offsets[index + 1] - 1]
+
+    def end_at(self, index: int) -> float:
+        """字幕结束时间；没有时长信息时用下一条字幕的开始时间"""
+        duration = self.durations[index]
+        if duration > 0:
+            return self.starts[index] + duration
+        if index + 1 < len(self.starts):
+            return self.starts[index + 1]
+        return self.starts[index]
+
+    def cues(self) -> Iterator[Tuple[float, float, str]]:
+        for index in range(len(self.starts)):
+            yield self.starts[index], self.durations[index], self.text_at(index)
+
+    def render_text(self) -> str:
+        return self.text
+
+    def render_timestamps(self) -> List[str]:
+        timestamps = []
+        for start, _, text in self.cues():
+            minutes, seconds = divmod(int(start), 60)
+            timestamps.append(f"{minutes}:{seconds:02d} - {text}")
+        return timestamps
+
+    def render_srt(self) -> str:
+        parts = []
+        for index in range(len(self.starts)):
+            start = _clock(self.starts[index], ",")
+            end = _clock(self.end_at(index), ",")
+            parts.append(f"{index + 1}\n{start} --> {end}\n{self.text_at(index)}\n\n")
+        return "".join(parts)
+
+    def render_vtt(self) -> str:
+        parts = ["WEBVTT\n\n"]
+        for index in range(len(self.starts)):
+            start = _clock(self.starts[index], ".")
+            end = _clock(self.end_at(index), ".")
+            parts.append(f"{start} --> {end}\n{self.text_at(index)}\n\n")
+        return "".join(parts)
+
+    def render_json(self) -> List[dict]:
+        return [{"start": start, "duration": duration, "text": text} for start, duration, text in self.cues()]
+
+    def render(self, format: str):
+        """Render into one of FORMATS."""
+        if format not in FORMATS:
+            raise ValueError(f"Unsupported format: {format}")
+        return getattr(self, f"render_{format}")()
+
+
+def align_transcripts(transcripts: List[Tuple[str, "Transcript"]]) -> List[dict]:
+    """Align several tracks on the cue start times of the first one.
+
+    Each cue of the other tracks is attached to the last reference cue that
+    starts at or before it (two pointers, one linear pass per track), so every
+    output row carries a start/end range and one text per language.
+    """
+    if not transcripts:
+        return []
+    _, reference = transcripts[0]
+    rows = [
+        {"start": reference.starts[index], "end": reference.end_at(index), "text": {}}
+        for index in range(len(reference))
+    ]
+    if not rows:
+        return rows
+
+    for language, transcript in transcripts:
+        texts: List[List[str]] = [[] for _ in rows]
+        row = 0
+        for start, _, text in transcript.cues():
+            # 允许少量误差，不同语言的字幕时间通常只差几十毫秒
+            while row + 1 < len(rows) and rows[row + 1]["start"] <= start + 0.05:
+                row += 1
+            texts[row].append(text)
+        for index, parts in enumerate(texts):
+            rows[index]["text"][language] = " ".join(parts)
+    return rows
+
+
+def merge_cues(transcript: Transcript, mode: str, window: float = 30.0, chapters: int = 10) -> Transcript:
+    """Merge consecutive cues into fixed windows, sentences or a number of chapters.
+
+    ``window`` is the window length for ``window`` and the longest sentence for
+    ``sentence`` (ASR tracks have no punctuation). ``chapters`` splits the
+    video into that many equal time spans. Cue texts are already joined by
+    single spaces in the text buffer, so a merged cue is a slice of the same
+    buffer: one linear pass rebuilds only the start, duration and offset arrays.
+    """
+    if mode not in MERGE_MODES:
+        raise ValueError(f"Unsupported merge mode: {mode}")
+    count = len(transcript)
+    if count == 0:
+        return transcript
+
+    starts = transcript.starts
+    first = starts[0]
+    if mode == "chapters":
+        # 按总时长均分，分组编号最大为 chapters - 1，结果不超过 chapters 段
+        window = max(transcript.end_at(count - 1) - first, 1e-9) / chapters
+
+    merged_starts = array("d")
+    merged_durations = array("d")
+    merged_offsets = array("I")
+    group = 0
+    for index in range(1, count + 1):
+        if index < count:
+            if mode == "sentence":
+                text = transcript.text_at(index - 1).rstrip().rstrip(_CLOSING)
+                if not text.endswith(_SENTENCE_END) and starts[index] - starts[group] < window:
+                    continue
+            elif mode == "window":
+                # 窗口按视频时间对齐：0:00、0:30、1:00 ...
+                if int(starts[index] // window) == int(starts[group] // window):
+                    continue
+            elif min(int((starts[index] - first) // window), chapters - 1) == min(
+                int((starts[group] - first) // window), chapters - 1
+            ):
+                continue
+        merged_starts.append(starts[group])
+        merged_durations.append(transcript.end_at(index - 1) - starts[group])
+        merged_offsets.append(transcript.offsets[group])
+        group = index
+    merged_offsets.append(transcript.offsets[count])
+    return Transcript(merged_starts, merged_durations, transcript.text, merged_offsets, transcript.language)
@@ -0,0 +1,198 @@
+"""流式扫描视频页面，找到 captionTracks 数组后立即停止下载"""
+import json
+import logging
+import re
+from typing import List, Optional, Tuple
+from urllib.parse import urlencode
+
+from fetcher import fetch_text, stream_text, YOUTUBE_BASE_URL
+from metrics import stage, should_dump_payload
+
+logger = logging.getLogger(__name__)
+
+# 扫描数组时只关心这几个字符
+_SPECIAL_CHARS = re.compile(r'[\[\]"\\]')
+_PLAYLIST_VIDEO_ID = re.compile(r'"playlistVideoRenderer":\{"videoId":"([\w-]{11})"')
+
+
+class CaptionTrackScanner:
+    """Incrementally locate the ``"captionTracks":[...]`` array in a watch page.
+
+    Chunks are fed as they arrive. Before the marker is found only a short tail
+    is kept (so a marker split across chunks is still found); after that only
+    the array itself is buffered. Brackets inside JSON strings are ignored, so
+    nested arrays and ``]`` inside names do not end the array early.
+    """
+
+    MARKER = '"captionTracks":'
+    # ytInitialPlayerResponse 中 videoDetails 位于 captions 之后，先遇到它说明视频没有字幕
+    END_MARKER = '"videoDetails":'
+
+    def __init__(self):
+        self.finished = False
+        self.chars_scanned = 0
+        self._tail = ""
+        self._parts: List[str] = []
+        self._started = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._result: Optional[str] = None
+        # 在 captionTracks 之前遇到了 videoDetails：确实是视频页面，且没有字幕
+        self.no_captions = False
+
+    def feed(self, chunk: str) -> bool:
+        """Consume a chunk, return True once no more input is needed."""
+        if self.finished:
+            return True
+        self.chars_scanned += len(chunk)
+
+        if not self._started:
+            data = self._tail + chunk
+            index = data.find(self.MARKER)
+            end_index = data.find(self.END_MARKER)
+            if end_index != -1 and (index == -1 or end_index < index):
+                self.finished = True
+                self.no_captions = True
+                return True
+            if index == -1:
+                keep = max(len(self.MARKER), len(self.END_MARKER)) - 1
+                self._tail = data[-keep:]
+                return False
+            self._tail = ""
+            self._started = True
+            chunk = data[index + len(self.MARKER):]
+
+        return self._scan(chunk)
+
+    def _scan(self, chunk: str) -> bool:
+        position = 0
+        while True:
+            if self._escape:
+                # 上一个分块以反斜杠结尾，跳过被转义的字符
+                if position >= len(chunk):
+                    break
+                self._escape = False
+                position += 1
+            match = _SPECIAL_CHARS.search(chunk, position)
+            if match is None:
+                break
+            char = match.group()
+            position = match.end()
+            if char == "\\":
+                if self._in_string:
+                    self._escape = True
+            elif char == '"':
+                self._in_string = not self._in_string
+            elif self._in_string:
+                continue
+            elif char == "[":
+                self._depth += 1
+            elif char == "]":
+                self._depth -= 1
+                if self._depth == 0:
+                    self._parts.append(chunk[:position])
+                    self._result = "".join(self._parts).strip()
+                    self._parts = []
+                    self.finished = True
+                    return True
+        self._parts.append(chunk)
+        return False
+
+    def tracks(self) -> Optional[List[dict]]:
+        """解析出的字幕轨道列表；确认没有字幕时返回空列表，没有识别出视频页面时返回 None"""
+        if self._result is None:
+            return [] if self.no_captions else None
+        return json.loads(self._result)
+
+
+async def fetch_caption_tracks(video_id: str) -> Optional[List[dict]]:
+    """Stream the watch page and return its caption track list.
+
+    The list is empty only when the page's ``videoDetails`` came before any
+    ``captionTracks``, i.e. the video really has no captions. None means the
+    page was not recognised (a consent or error page), which proves nothing.
+    A non-2xx page raises, see ``fetcher.raise_for_status``.
+    """
+    url = f"{YOUTUBE_BASE_URL}/watch?v={video_id}"
+    logger.debug(f"正在获取视频页面: {url}")
+    scanner = CaptionTrackScanner()
+    dump = should_dump_payload()
+    with stage("watch_page_fetch"):
+        async with stream_text(url) as chunks:
+            async for chunk in chunks:
+                if dump and scanner.chars_scanned == 0:
+                    logger.debug(f"获取到的 HTML 开头: {chunk[:10000]}")
+                if scanner.feed(chunk):
+                    break
+    logger.debug(f"扫描视频页面 {scanner.chars_scanned} 个字符后停止")
+    with stage("track_extraction"):
+        return scanner.tracks()
+
+
+async def fetch_playlist_video_ids(playlist_id: str) -> List[str]:
+    """Video IDs of a playlist in order, as listed in the playlist page.
+
+    Only the videos embedded in the first page are returned (YouTube loads
+    the rest, beyond about 100, through continuation requests).
+    """
+    html = await fetch_text(f"{YOUTUBE_BASE_URL}/playlist", params={"list": playlist_id})
+    # 同一视频可能在列表中出现多次，保留第一次出现的位置
+    return list(dict.fromkeys(_PLAYLIST_VIDEO_ID.findall(html)))
+
+
+def build_track_index(tracks: List[dict]) -> List[dict]:
+    """Reduce the raw captionTracks list to language, kind and base URL per track."""
+    index = []
+    for track in tracks:
+        if not track.get("baseUrl"):
+            continue
+        index.append({
+            "language": track.get("languageCode", ""),
+            "kind": "asr" if track.get("kind") == "asr" else "manual",
+            "base_url": track["baseUrl"],
+            "translatable": bool(track.get("isTranslatable")),
+        })
+    return index
+
+
+def _same_language(code: str, wanted: str) -> bool:
+    """zh 可以匹配 zh-Hans，en 可以匹配 en-US"""
+    return code == wanted or code.split("-")[0] == wanted.split("-")[0]
+
+
+def select_track(index: List[dict], languages: Optional[List[str]] = None) -> Optional[Tuple[dict, Optional[str]]]:
+    """Pick the track to fetch, returning ``(track, translate_to)``.
+
+    Requested languages are tried in order, manual tracks before generated
+    ones, first by exact code and then by base language (``zh`` matches
+    ``zh-Hans``). If none exists natively, a translatable track is translated
+    into the first requested language. Without requested languages the first
+    manual track wins, then the first generated one.
+    """
+    for wanted in languages or []:
+        for match in (lambda code: code == wanted, lambda code: _same_language(code, wanted)):
+            for kind in ("manual", "asr"):
+                for track in index:
+                    if track["kind"] == kind and match(track["language"]):
+                        return track, None
+
+    if languages:
+        translatable = [track for track in index if track["translatable"]]
+        if translatable:
+            # 优先翻译手动字幕
+            translatable.sort(key=lambda track: track["kind"] != "manual")
+            return translatable[0], languages[0]
+
+    for kind in ("manual", "asr"):
+        for track in index:
+            if track["kind"] == kind:
+                return track, None
+    return None
+
+
+def track_url(track: dict, translate_to: Optional[str] = None) -> str:
+    """字幕下载地址，需要翻译时加上 tlang 参数"""
+    if translate_to:
+        return f"{track['base_url']}&{urlencode({'tlang': translate_to})}"
+    return track["base_url"]
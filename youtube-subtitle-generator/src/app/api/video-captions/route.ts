@@ -29,6 +29,20 @@ async function fetchWithRetry(
   throw lastError;
 }
 
+// 后端请求失败时返回错误信息
+async function errorResponse(response: Response) {
+  const errorText = await response.text();
+  // 服务繁忙时透传 Retry-After，让前端知道何时再试
+  const retryAfter = response.headers.get("Retry-After");
+  return NextResponse.json(
+    { error: `API 请求失败: ${errorText}` },
+    {
+      status: response.status,
+      headers: retryAfter ? { "Retry-After": retryAfter } : undefined,
+    }
+  );
+}
+
 export async function POST(request: NextRequest) {
   try {
     // 从请求中获取数据
@@ -50,11 +64,7 @@ export async function POST(request: NextRequest) {
 
     // 检查响应状态
     if (!response.ok) {
-      const errorText = await response.text();
-      return NextResponse.json(
-        { error: `API 请求失败: ${errorText}` },
-        { status: response.status }
-      );
+      return errorResponse(response);
     }
 
     // 返回 API 响应
@@ -68,3 +78,46 @@ export async function POST(request: NextRequest) {
     );
   }
 }
+
+// GET 请求透传 ETag 和 If-None-Match：浏览器再次请求同一字幕时后端返回 304，不重新传输内容
+export async function GET(request: NextRequest) {
+  try {
+    const ifNoneMatch = request.headers.get("If-None-Match");
+    const response = await fetchWithRetry(
+      `${API_URL}/video-captions${request.nextUrl.search}`,
+      {
+        method: "GET",
+        headers: ifNoneMatch ? { "If-None-Match": ifNoneMatch } : undefined,
+      },
+      3,
+      2000
+    );
+
+    const etag = response.headers.get("ETag");
+    if (response.status === 304) {
+      return new NextResponse(null, {
+        status: 304,
+        headers: etag ? { ETag: etag } : undefined,
+      });
+    }
+
+    if (!response.ok) {
+      return errorResponse(response);
+    }
+
+    // 直接转发响应体，不重新解析 JSON
+    return new NextResponse(await response.text(), {
+      headers: {
+        "Content-Type": response.headers.get("Content-Type") || "application/json",
+        "Cache-Control": "no-cache",
+        ...(etag ? { ETag: etag } : {}),
+      },
+    });
+  } catch (error) {
+    console.error("处理请求时出错:", error);
+    return NextResponse.json(
+      { error: "处理请求时出错，请确保 API 服务器正在运行" },
+      { status: 500 }
+    );
+  }
+}
@@ -143,9 +143,14 @@ export async function POST(request: NextRequest) {
     // 检查响应状态
     if (!response.ok) {
       const errorText = await response.text();
+      // 服务繁忙时透传 Retry-After，让前端知道何时再试
+      const retryAfter = response.headers.get("Retry-After");
       return NextResponse.json(
         { error: `API 请求失败: ${errorText}` },
-        { status: response.status }
+        {
+          status: response.status,
+          headers: retryAfter ? { "Retry-After": retryAfter } : undefined,
+        }
       );
     }
 
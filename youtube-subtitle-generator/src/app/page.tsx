@@ -38,9 +38,11 @@ export default function Home() {
       setCaptions(captionsResult);
 
       // 获取时间戳
+      // 按句子合并，自动生成的字幕没有标点时每段最长 30 秒
       const timestampsResult = await getVideoTimestamps({
         url: data.url,
         languages: data.languages,
+        merge: "sentence",
       });
       setTimestamps(timestampsResult);
 
@@ -28,6 +28,10 @@ export interface VideoData {
 export interface YouTubeRequest {
   url: string;
   languages?: string[];
+  // 时间戳接口：把相邻字幕合并为固定窗口、句子或章节，减少返回的条数
+  merge?: "window" | "sentence" | "chapters";
+  window?: number;
+  chapters?: number;
 }
 
 export const getVideoData = async (
@@ -66,7 +70,11 @@ export const getVideoCaptions = async (
 ): Promise<string> => {
   try {
     console.log("发送字幕请求:", request);
-    const response = await apiClient.post("/video-captions", request);
+    // 使用 GET，浏览器会缓存响应并在再次请求时用 ETag 验证，字幕未变化时服务器返回 304
+    const response = await apiClient.get("/video-captions", {
+      params: request,
+      paramsSerializer: { indexes: null },
+    });
     return response.data;
   } catch (error) {
     console.error("Error fetching video captions:", error);
@@ -100,7 +108,11 @@ export const getVideoTimestamps = async (
 ): Promise<string[]> => {
   try {
     console.log("发送时间戳请求:", request);
-    const response = await apiClient.post("/video-timestamps", request);
+    // 使用 GET，浏览器会缓存响应并在再次请求时用 ETag 验证，字幕未变化时服务器返回 304
+    const response = await apiClient.get("/video-timestamps", {
+      params: request,
+      paramsSerializer: { indexes: null },
+    });
     return response.data;
   } catch (error) {
     console.error("Error fetching video timestamps:", error);